@@ -1,6 +1,5 @@
 import os
 import mariadb
-import time
 from fastapi import HTTPException, status
 
 # JWT validation constants
@@ -17,22 +16,20 @@ db_config = {
     "user": os.getenv("DB_USER", "Bookstore"),
     "password": os.getenv("DB_PASSWORD", "password"),
     "database": os.getenv("DB_NAME", "Bookstore"),
-    "connect_timeout": 100000
+    "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "3")),  # Seconds per connection attempt
+    "read_timeout": int(os.getenv("DB_QUERY_TIMEOUT", "10")),      # Hard cap on waiting for a query result
+    "write_timeout": int(os.getenv("DB_QUERY_TIMEOUT", "10"))
 }
 
 def get_db_connection():
-    retries = 5
-    while retries > 0:
-        try:
-            connection = mariadb.connect(**db_config)
-            connection.autocommit = False
-            return connection
-        except mariadb.Error as e:
-            print(f"Database connection error: {str(e)}")
-            retries -= 1
-            if retries == 0:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Database connection failed: {str(e)}"
-                )
-            time.sleep(1) 
\ No newline at end of file
+    # Fail fast instead of sleeping inside async handlers; callers get a 503 to retry
+    try:
+        connection = mariadb.connect(**db_config)
+        connection.autocommit = False
+        return connection
+    except mariadb.Error as e:
+        print(f"Database connection error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Database connection failed: {str(e)}"
+        )
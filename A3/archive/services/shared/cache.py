@@ -0,0 +1,395 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from .cache_client import CacheUnavailableError, get_cache_client
+from .fast_json import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Stored for keys the loader found nothing for; a string so it survives SharedBackend's JSON
+_NOT_FOUND = "\x00not-found"
+
+
+class LRUStore:
+    """
+    Bounded map whose entries expire ttl seconds after they were set; past
+    max_entries the least recently used entry is evicted. With max_bytes
+    set, values must be bytes and their total size is bounded as well.
+
+    Holds the entries of LocalBackend and of the cache daemon.
+    """
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires, value), least recently used first
+        self._bytes = 0
+        self._stats = {"evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.monotonic():
+            self._remove(key)
+            self._stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl):
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        if self.max_bytes is not None:
+            self._bytes += len(value)
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def add(self, key, value, ttl):
+        """set() unless key already holds a live entry; True if the value was stored."""
+        if self.get(key) is not None:
+            return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key):
+        return self._remove(key)
+
+    def delete_prefix(self, prefix):
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        if self.max_bytes is not None:
+            self._bytes -= len(entry[1])
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        stats = {"entries": len(self._entries), "max_entries": self.max_entries, **self._stats}
+        if self.max_bytes is not None:
+            stats.update(bytes=self._bytes, max_bytes=self.max_bytes)
+        return stats
+
+
+class LocalBackend:
+    """Cache entries in this worker process's memory, as Python objects."""
+
+    def __init__(self, max_entries):
+        self._store = LRUStore(max_entries)
+
+    async def get(self, key):
+        return self._store.get(key)
+
+    async def set(self, key, value, ttl):
+        self._store.set(key, value, ttl)
+
+    async def add(self, key, value, ttl):
+        return self._store.add(key, value, ttl)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._store.delete(key)
+
+    async def clear(self):
+        self._store.clear()
+
+    def stats(self):
+        return {"backend": "local", **self._store.stats()}
+
+
+class SharedBackend:
+    """
+    Cache entries in the cache daemon, shared by every worker in the
+    container. Values are stored as JSON, so they come back as plain JSON
+    types (a Decimal comes back as a float). Keys are prefixed with the
+    namespace so several caches can share one daemon.
+
+    Reads fail open like CacheClient: with the daemon down get() misses and
+    set() is dropped. delete() and clear() are never dropped; they raise
+    CacheUnavailableError if the daemon is up but does not confirm them.
+    add() fails closed: it raises unless the daemon confirms the claim.
+    """
+
+    def __init__(self, client, namespace):
+        self._client = client
+        self._prefix = f"{namespace}:".encode()
+
+    def _key(self, key):
+        return self._prefix + str(key).encode()
+
+    async def get(self, key):
+        reply = await self._client.request(b"GET", self._key(key))
+        if reply is None or reply[0] != b"HIT":
+            return None
+        return loads(reply[1])
+
+    async def set(self, key, value, ttl):
+        await self._client.request(b"SET", self._key(key), repr(float(ttl)).encode(), dumps(value))
+
+    async def add(self, key, value, ttl):
+        reply = await self._client.request_confirmed(b"ADD", self._key(key), repr(float(ttl)).encode(), dumps(value))
+        if reply is None:
+            raise CacheUnavailableError(f"No cache daemon at {self._client.path} to claim {key}")
+        return reply[0] == b"OK"
+
+    async def delete(self, *keys):
+        if keys:
+            await self._client.request_confirmed(b"DEL", *(self._key(key) for key in keys))
+
+    async def clear(self):
+        await self._client.request_confirmed(b"CLEAR", self._prefix)
+
+    def stats(self):
+        return {"backend": "shared", **self._client.stats()}
+
+
+def create_cache_backend(namespace, max_entries):
+    """
+    A SharedBackend on the cache daemon when CACHE_SOCKET is set, else a
+    LocalBackend holding up to max_entries entries in this process.
+    """
+    client = get_cache_client()
+    if client is None:
+        return LocalBackend(max_entries)
+    return SharedBackend(client, namespace)
+
+
+async def cache_daemon_stats():
+    """The cache daemon's own counters, or None when there is no daemon or it did not answer."""
+    client = get_cache_client()
+    reply = await client.request(b"STATS") if client is not None else None
+    if reply is None or reply[0] != b"OK":
+        return None
+    return loads(reply[1])
+
+
+class TTLCache:
+    """
+    Read-through cache whose entries expire ttl seconds after they were
+    loaded. Entries live in the backend from create_cache_backend(name,
+    max_entries) unless one is passed in.
+
+    get_or_load() coalesces concurrent misses within this worker: the first
+    caller runs the loader, later callers for the same key await its result.
+    invalidate() drops an entry and also discards the result of a load still
+    in flight here, so a read that raced a write cannot put the old value
+    back.
+
+    None results are cached only with a negative_ttl, for that long: a
+    negative hit returns None without calling the loader. Found values are
+    kept for ttl seconds; ttl=0 makes this a cache of not-found keys only.
+    """
+
+    def __init__(self, name, max_entries, ttl, negative_ttl=0, backend=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._backend = backend if backend is not None else create_cache_backend(name, max_entries)
+        self._loading = {}  # key -> future of the load in flight
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0,
+                       "failed_invalidations": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and (self.ttl > 0 or self.negative_ttl > 0)
+
+    async def get_or_load(self, key, loader):
+        """Return the cached value for key, or await loader() and cache its result."""
+        if not self.enabled:
+            return await loader()
+
+        value = await self._backend.get(key)
+        if value == _NOT_FOUND:
+            self._stats["negative_hits"] += 1
+            return None
+        if value is not None:
+            self._stats["hits"] += 1
+            return value
+
+        future = self._loading.get(key)
+        if future is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        self._stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+            future.set_exception(e)
+            future.exception()  # Mark retrieved so an unawaited future does not log
+            raise
+
+        try:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+                if value is None:
+                    if self.negative_ttl > 0:
+                        await self._backend.set(key, _NOT_FOUND, self.negative_ttl)
+                elif self.ttl > 0:
+                    await self._backend.set(key, value, self.ttl)
+        finally:
+            future.set_result(value)
+        return value
+
+    async def set(self, key, value):
+        """Store value for key for ttl seconds, e.g. an entry refreshed outside get_or_load()."""
+        if self.enabled and self.ttl > 0:
+            await self._backend.set(key, value, self.ttl)
+
+    async def invalidate(self, *keys):
+        for key in keys:
+            self._loading.pop(key, None)
+        self._stats["invalidations"] += len(keys)
+        await self._backend.delete(*keys)
+
+    async def invalidate_after_write(self, *keys):
+        """
+        invalidate() for a write that is already committed. If the cache
+        daemon does not confirm it, the failure is logged rather than raised:
+        the write stands, so its response must not turn into an error (which
+        would also keep an Idempotency-Key retry from replaying it). The
+        entries then stay until they expire.
+        """
+        try:
+            await self.invalidate(*keys)
+        except CacheUnavailableError as e:
+            self._stats["failed_invalidations"] += 1
+            logger.warning(f"Could not invalidate {self.name} entries {keys}: {e}")
+
+    async def clear(self):
+        self._loading.clear()
+        await self._backend.clear()
+
+    def stats(self):
+        hits = self._stats["hits"] + self._stats["negative_hits"]
+        lookups = hits + self._stats["misses"] + self._stats["coalesced"]
+        return {
+            "ttl": self.ttl,
+            "negative_ttl": self.negative_ttl,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            **self._stats,
+            **self._backend.stats(),
+        }
+
+
+class StaleWhileRevalidateCache:
+    """
+    Cache in front of a slow or unreliable source, e.g. an external service.
+
+    An entry is served as is for fresh_ttl seconds after it was loaded. For
+    revalidate_ttl seconds after that it is still served right away while
+    one background load per key replaces it. Older entries are kept up to
+    max_stale seconds and served only when loading fails (the source is
+    down, its circuit is open, the call timed out). Every loaded value is
+    cached, empty results included.
+
+    Entries carry their load time in wall-clock seconds so their age means
+    the same in every worker sharing the backend.
+    """
+
+    def __init__(self, name, max_entries, fresh_ttl, revalidate_ttl, max_stale, backend=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.fresh_ttl = fresh_ttl
+        self.revalidate_ttl = revalidate_ttl
+        self.max_stale = max(max_stale, fresh_ttl + revalidate_ttl)
+        self._backend = backend if backend is not None else create_cache_backend(name, max_entries)
+        self._loading = {}      # key -> future of the load in flight
+        self._refreshes = set()
+        self._stats = {"hits": 0, "stale_hits": 0, "stale_on_error": 0, "misses": 0, "coalesced": 0,
+                       "refreshes": 0, "failed_refreshes": 0}
+
+    async def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, or await loader() and cache its
+        result. If loader() raises and an entry within max_stale exists, that
+        entry is returned instead.
+        """
+        if self.max_entries <= 0:
+            return await loader()
+
+        entry = await self._backend.get(key)
+        if entry is not None:
+            age = time.time() - entry["loaded"]
+            if age < self.fresh_ttl:
+                self._stats["hits"] += 1
+                return entry["value"]
+            if age < self.fresh_ttl + self.revalidate_ttl:
+                self._stats["stale_hits"] += 1
+                self._refresh(key, loader)
+                return entry["value"]
+
+        self._stats["misses"] += 1
+        try:
+            return await self._load(key, loader)
+        except Exception as e:
+            if entry is None:
+                raise
+            self._stats["stale_on_error"] += 1
+            logger.warning(f"Serving stale {self.name} entry for {key}: {e!r}")
+            return entry["value"]
+
+    async def _load(self, key, loader):
+        future = self._loading.get(key)
+        if future is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            del self._loading[key]
+            future.set_exception(e)
+            future.exception()  # Mark retrieved so an unawaited future does not log
+            raise
+        del self._loading[key]
+        future.set_result(value)
+        await self._backend.set(key, {"loaded": time.time(), "value": value}, self.max_stale)
+        return value
+
+    def _refresh(self, key, loader):
+        if key in self._loading:
+            return  # Already being loaded; that load replaces the entry
+        self._stats["refreshes"] += 1
+        task = asyncio.ensure_future(self._load(key, loader))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task):
+        self._refreshes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self._stats["failed_refreshes"] += 1
+            logger.info(f"Background refresh of {self.name} failed: {task.exception()!r}")
+
+    def stats(self):
+        return {
+            "fresh_ttl": self.fresh_ttl,
+            "revalidate_ttl": self.revalidate_ttl,
+            "max_stale": self.max_stale,
+            "refreshing": len(self._refreshes),
+            **self._stats,
+            **self._backend.stats(),
+        }
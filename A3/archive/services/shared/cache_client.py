@@ -0,0 +1,154 @@
+import os
+import time
+import struct
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_SOCKET = os.getenv("CACHE_SOCKET", "")                           # Unix socket of the cache daemon; empty keeps caches in-process
+CACHE_TIMEOUT = float(os.getenv("CACHE_TIMEOUT", "0.1"))               # Seconds a single cache command may take
+CACHE_MAX_IDLE = int(os.getenv("CACHE_MAX_IDLE", "8"))                 # Idle daemon connections kept per worker
+CACHE_RETRY_AFTER = float(os.getenv("CACHE_RETRY_AFTER", "5"))         # Seconds to skip the daemon after it kept failing
+CACHE_MAX_FAILURES = int(os.getenv("CACHE_MAX_FAILURES", "3"))         # Consecutive failures before the daemon is skipped
+CACHE_ATTEMPTS = int(os.getenv("CACHE_ATTEMPTS", "3"))                 # Tries for a command that must not be dropped (DEL, ADD)
+
+# A frame is a field count followed by length-prefixed fields. Requests are
+# (command, *arguments); replies are (status, *values).
+_COUNT = struct.Struct("!H")
+_LENGTH = struct.Struct("!I")
+
+
+def encode_frame(*fields):
+    parts = [_COUNT.pack(len(fields))]
+    for field in fields:
+        parts.append(_LENGTH.pack(len(field)))
+        parts.append(field)
+    return b"".join(parts)
+
+
+async def read_frame(reader):
+    count, = _COUNT.unpack(await reader.readexactly(_COUNT.size))
+    fields = []
+    for _ in range(count):
+        length, = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+        fields.append(await reader.readexactly(length))
+    return fields
+
+
+class CacheUnavailableError(Exception):
+    """The cache daemon did not answer a command that must not be dropped."""
+
+
+class CacheClient:
+    """
+    Connection to the cache daemon (cache_daemon.py) for one worker process.
+
+    Reads and cache fills fail open: if the daemon is unreachable, slow or
+    broken, request() returns None and callers carry on as on a miss. After
+    max_failures failures in a row the daemon is skipped for retry_after
+    seconds instead of every request waiting out its timeout.
+
+    Invalidations and claims go through request_confirmed() instead, which
+    is never skipped and raises rather than dropping the command.
+    """
+
+    def __init__(self, path, timeout=CACHE_TIMEOUT, max_idle=CACHE_MAX_IDLE, retry_after=CACHE_RETRY_AFTER,
+                 max_failures=CACHE_MAX_FAILURES, attempts=CACHE_ATTEMPTS):
+        self.path = path
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.retry_after = retry_after
+        self.max_failures = max_failures
+        self.attempts = attempts
+        self._idle = []  # (reader, writer)
+        self._failures = 0
+        self._down_until = 0.0
+        self._stats = {"requests": 0, "errors": 0, "skipped": 0}
+
+    async def request(self, *fields):
+        """Send one command and return the reply fields, or None if the daemon could not answer."""
+        if self._down_until and time.monotonic() < self._down_until:
+            self._stats["skipped"] += 1
+            return None
+        try:
+            return await self._send(fields)
+        except (OSError, EOFError, asyncio.TimeoutError):
+            return None
+
+    async def request_confirmed(self, *fields):
+        """
+        Send a command whose loss would serve stale data or run a request
+        twice, trying up to attempts times even while the daemon is being
+        skipped, and return the reply fields. Returns None if no daemon is
+        listening at all, as it then holds no entries either; raises
+        CacheUnavailableError if the daemon is there but did not answer.
+        """
+        for _ in range(self.attempts):
+            try:
+                return await self._send(fields)
+            except (ConnectionRefusedError, FileNotFoundError):
+                return None
+            except (OSError, EOFError, asyncio.TimeoutError) as e:
+                error = e
+        raise CacheUnavailableError(f"Cache daemon at {self.path} did not answer {fields[0].decode()}: {error!r}")
+
+    async def _send(self, fields):
+        self._stats["requests"] += 1
+        try:
+            reply = await asyncio.wait_for(self._request(fields), self.timeout)
+        except (OSError, EOFError, asyncio.TimeoutError) as e:
+            self._stats["errors"] += 1
+            self._failures += 1
+            if self._failures >= self.max_failures:
+                if not self._down_until:
+                    logger.warning(f"Cache daemon at {self.path} unavailable, skipping reads for {self.retry_after}s: {e!r}")
+                self._down_until = time.monotonic() + self.retry_after
+            raise
+        self._failures = 0
+        self._down_until = 0.0
+        return reply
+
+    async def _request(self, fields):
+        if self._idle:
+            reader, writer = self._idle.pop()
+        else:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        try:
+            writer.write(encode_frame(*fields))
+            reply = await read_frame(reader)
+        except BaseException:
+            # The reply may still be in flight; the connection cannot be reused
+            writer.close()
+            raise
+        if len(self._idle) < self.max_idle:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        return reply
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+    def stats(self):
+        return {"socket": self.path, "idle_connections": len(self._idle), "down": bool(self._down_until), **self._stats}
+
+
+_client = None
+
+
+def get_cache_client():
+    """This process's CacheClient, or None when CACHE_SOCKET is not set."""
+    global _client
+    if not CACHE_SOCKET:
+        return None
+    if _client is None:
+        _client = CacheClient(CACHE_SOCKET)
+    return _client
+
+
+async def close_cache_client():
+    if _client is not None:
+        await _client.close()
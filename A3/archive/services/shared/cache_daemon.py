@@ -0,0 +1,107 @@
+"""
+Cache daemon shared by the uvicorn workers of one container.
+
+Each worker keeping its own cache splits the hit rate N ways and stores
+every entry N times. The entrypoints start this daemon next to uvicorn and
+point the workers at it through CACHE_SOCKET; TTLCache and IdempotencyStore
+then keep their entries here (see SharedBackend in cache.py).
+
+    python -m services.shared.cache_daemon
+
+Commands (frames as in cache_client.py):
+    GET key               -> HIT value | MISS
+    SET key ttl value     -> OK
+    ADD key ttl value     -> OK | EXISTS   (set only if key is absent)
+    DEL key...            -> OK count
+    CLEAR prefix          -> OK count
+    STATS                 -> OK json
+"""
+import os
+import asyncio
+import logging
+
+from .cache import LRUStore
+from .cache_client import CACHE_SOCKET, encode_frame, read_frame
+from .fast_json import dumps
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "100000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))   # Total size of stored values
+DEFAULT_SOCKET = "/tmp/bookstore-cache.sock"
+
+
+class CacheDaemon:
+    def __init__(self, store):
+        self._store = store
+        self._connections = 0
+        self._commands = {
+            b"GET": self._get,
+            b"SET": self._set,
+            b"ADD": self._add,
+            b"DEL": self._delete,
+            b"CLEAR": self._clear,
+            b"STATS": self._stats,
+        }
+
+    async def handle(self, reader, writer):
+        self._connections += 1
+        try:
+            while True:
+                fields = await read_frame(reader)
+                writer.write(encode_frame(*self.dispatch(fields)))
+                await writer.drain()
+        except (EOFError, ConnectionError):
+            pass  # Worker closed the connection
+        finally:
+            self._connections -= 1
+            writer.close()
+
+    def dispatch(self, fields):
+        command = self._commands.get(fields[0]) if fields else None
+        if command is None:
+            return b"ERR", b"unknown command"
+        try:
+            return command(*fields[1:])
+        except (TypeError, ValueError) as e:
+            return b"ERR", str(e).encode()
+
+    def _get(self, key):
+        value = self._store.get(key)
+        return (b"MISS",) if value is None else (b"HIT", value)
+
+    def _set(self, key, ttl, value):
+        self._store.set(key, value, float(ttl))
+        return (b"OK",)
+
+    def _add(self, key, ttl, value):
+        return (b"OK",) if self._store.add(key, value, float(ttl)) else (b"EXISTS",)
+
+    def _delete(self, *keys):
+        return b"OK", str(sum(self._store.delete(key) for key in keys)).encode()
+
+    def _clear(self, prefix):
+        return b"OK", str(self._store.delete_prefix(prefix)).encode()
+
+    def _stats(self):
+        return b"OK", dumps({"connections": self._connections, **self._store.stats()})
+
+
+async def serve(path):
+    # A socket file left by a previous run would make the bind fail
+    if os.path.exists(path):
+        os.unlink(path)
+    daemon = CacheDaemon(LRUStore(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES))
+    server = await asyncio.start_unix_server(daemon.handle, path=path)
+    logger.info(f"Cache daemon listening on {path}: up to {CACHE_MAX_ENTRIES} entries, {CACHE_MAX_BYTES} bytes")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(CACHE_SOCKET or DEFAULT_SOCKET))
+
+
+if __name__ == "__main__":
+    main()
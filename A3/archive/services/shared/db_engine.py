@@ -0,0 +1,430 @@
+import os
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, status
+
+import mariadb
+
+from .db_pool import ConnectionPool, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_IDLE_TIMEOUT, DB_POOL_BORROW_TIMEOUT
+from .db_executor import DBExecutor
+from .db_health import DatabaseHealth, acquire_with_backoff, DB_QUERY_TIMEOUT
+from .statement_cache import StatementCache
+from .db_router import RoutingEngine, parse_replica_hosts, DB_REPLICA_HOSTS
+
+try:
+    import aiomysql
+except ImportError:  # Only needed when DB_ENGINE=async
+    aiomysql = None
+
+logger = logging.getLogger(__name__)
+
+# "threaded": mariadb connector on the DBExecutor thread pool
+# "async":    aiomysql, non-blocking I/O on the event loop
+DB_ENGINE = os.getenv("DB_ENGINE", "threaded").lower()
+
+ExecuteResult = namedtuple("ExecuteResult", ["rowcount", "lastrowid"])
+
+ER_DUP_ENTRY = 1062
+
+
+class DuplicateKeyError(Exception):
+    """A write violated a primary key or unique constraint."""
+
+
+def is_duplicate_key(error):
+    errno = getattr(error, "errno", None)
+    if errno is None and error.args and isinstance(error.args[0], int):
+        errno = error.args[0]  # pymysql/aiomysql put the code in args[0]
+    return errno == ER_DUP_ENTRY or str(error).startswith("Duplicate entry")
+
+
+def query_timeout_error():
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail="Database query timed out"
+    )
+
+
+class ThreadedSession:
+    """
+    A pooled mariadb connection whose calls run on the DBExecutor. Statements
+    are executed through the connection's cached prepared cursors.
+    """
+
+    def __init__(self, conn, executor, statements, timeout=DB_QUERY_TIMEOUT):
+        self._conn = conn
+        self._executor = executor
+        self._statements = statements
+        self._timeout = timeout
+        self._lock = threading.Lock()  # Serializes use of the connection across executor threads
+        self.timed_out = False
+        self.stream_open = False  # An unbuffered result has unread rows; see stream()
+
+    async def fetchone(self, sql, args=(), dictionary=True):
+        return await self._run(self._fetch, sql, args, False, dictionary)
+
+    async def fetchall(self, sql, args=(), dictionary=True):
+        return await self._run(self._fetch, sql, args, True, dictionary)
+
+    async def stream(self, sql, args=(), size=1000):
+        """
+        Yield the result in lists of up to size rows, read from an unbuffered
+        cursor so only one batch is held in memory. If the caller stops early
+        the connection is discarded rather than draining the rest.
+        """
+        self.stream_open = True
+        cursor = await self._run(self._open_stream, sql, args)
+        while True:
+            rows = await self._run(cursor.fetchmany, size)
+            if not rows:
+                break
+            yield rows
+        await self._run(cursor.close)
+        self.stream_open = False
+
+    async def execute(self, sql, args=()):
+        return await self._run(self._execute, sql, args, False)
+
+    async def executemany(self, sql, seq_of_args):
+        return await self._run(self._execute, sql, seq_of_args, True)
+
+    async def commit(self):
+        await self._run(self._conn.commit)
+
+    async def rollback(self):
+        await self._run(self._conn.rollback)
+
+    async def savepoint(self, name):
+        await self._run(self._command, f"SAVEPOINT {name}")
+
+    async def rollback_to_savepoint(self, name):
+        await self._run(self._command, f"ROLLBACK TO SAVEPOINT {name}")
+
+    def discard(self, pool):
+        """
+        Throw the connection away once any query still running on it has
+        finished (bounded by the connection's read_timeout).
+        """
+        return self._executor.run(self._locked, pool.release, self._conn, True)
+
+    async def _run(self, fn, *args):
+        # The thread keeps running after a timeout; see discard()
+        try:
+            return await asyncio.wait_for(self._executor.run(self._locked, fn, *args), self._timeout)
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            raise query_timeout_error()
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _fetch(self, sql, args, many, dictionary):
+        cursor = self._statements.cursor(self._conn, sql, dictionary=dictionary)
+        try:
+            cursor.execute(sql, args)
+            return cursor.fetchall() if many else cursor.fetchone()
+        except mariadb.Error:
+            self._statements.discard(self._conn, sql, dictionary=dictionary)
+            raise
+
+    def _command(self, sql):
+        # Transaction control is not preparable everywhere, so use a plain cursor
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(sql)
+        finally:
+            cursor.close()
+
+    def _open_stream(self, sql, args):
+        cursor = self._conn.cursor(dictionary=True, buffered=False)
+        cursor.execute(sql, args)
+        return cursor
+
+    def _execute(self, sql, args, many):
+        cursor = self._statements.cursor(self._conn, sql)
+        try:
+            if many:
+                cursor.executemany(sql, args)
+            else:
+                cursor.execute(sql, args)
+            return ExecuteResult(cursor.rowcount, cursor.lastrowid)
+        except mariadb.IntegrityError as e:
+            if is_duplicate_key(e):
+                raise DuplicateKeyError(str(e))
+            raise
+        except mariadb.Error:
+            self._statements.discard(self._conn, sql)
+            raise
+
+
+class Engine:
+    """
+    Common interface of the engines. session(readonly, key) yields a session;
+    readonly/key let RoutingEngine send reads to replicas, single-host
+    engines ignore them.
+    """
+
+    def mark_written(self, *keys):
+        """Called after a commit that wrote the given keys (see RoutingEngine)."""
+
+
+class ThreadedEngine(Engine):
+    name = "threaded"
+
+    def __init__(self, connect, pool=None, executor=None):
+        self.statements = StatementCache()
+        self.pool = pool or ConnectionPool(connect, on_close=self.statements.forget)
+        self.executor = executor or DBExecutor()
+        self.health = DatabaseHealth()
+        # One permit per pool connection. Sessions wait for a permit on the
+        # event loop, so pool.acquire() only runs on a thread when a
+        # connection is free: a session holds its connection across awaits
+        # and needs executor threads for its queries and release, which
+        # threads blocked in the pool would otherwise take. Created on first
+        # use so it belongs to the running loop.
+        self._connections = None
+        self._waiting = 0
+
+    async def open(self):
+        await self.executor.run(self.pool.open)
+
+    async def close(self):
+        self.executor.shutdown()
+        self.pool.close()
+
+    @asynccontextmanager
+    async def session(self, readonly=False, key=None):
+        conn = await acquire_with_backoff(self._acquire, mariadb.Error, self.health)
+        session = ThreadedSession(conn, self.executor, self.statements)
+        try:
+            yield session
+        finally:
+            if session.timed_out:
+                # Keep the permit until the connection is really gone
+                task = asyncio.ensure_future(session.discard(self.pool))
+                task.add_done_callback(lambda _: self._connections.release())
+            else:
+                try:
+                    if session.stream_open:
+                        await session.discard(self.pool)
+                    else:
+                        await self.executor.run(self.pool.release, conn)
+                finally:
+                    self._connections.release()
+
+    async def _acquire(self, remaining):
+        if self._connections is None:
+            self._connections = asyncio.Semaphore(self.pool.max_size)
+        timeout = min(remaining, self.pool.borrow_timeout)
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._connections.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Timed out waiting for a database connection"
+            )
+        finally:
+            self._waiting -= 1
+        try:
+            return await self.executor.run(self.pool.acquire, timeout)
+        except BaseException:
+            self._connections.release()
+            raise
+
+    def stats(self):
+        return {"engine": self.name, "pool": self.pool.stats(), "executor": self.executor.stats(),
+                "waiting_for_connection": self._waiting, "statements": self.statements.stats(),
+                "health": self.health.stats()}
+
+
+class AsyncSession:
+    """A pooled aiomysql connection; every call is awaited on the event loop."""
+
+    def __init__(self, conn, timeout=DB_QUERY_TIMEOUT):
+        self._conn = conn
+        self._timeout = timeout
+        self.timed_out = False
+        self.stream_open = False
+
+    async def fetchone(self, sql, args=(), dictionary=True):
+        return await self._run(self._fetch(sql, args, False, dictionary))
+
+    async def fetchall(self, sql, args=(), dictionary=True):
+        return await self._run(self._fetch(sql, args, True, dictionary))
+
+    async def stream(self, sql, args=(), size=1000):
+        """Yield the result in lists of up to size rows from a server-side cursor."""
+        self.stream_open = True
+        cursor = await self._conn.cursor(aiomysql.SSDictCursor)
+        await self._run(cursor.execute(sql, args))
+        while True:
+            rows = await self._run(cursor.fetchmany(size))
+            if not rows:
+                break
+            yield rows
+        await self._run(cursor.close())
+        self.stream_open = False
+
+    async def execute(self, sql, args=()):
+        return await self._run(self._execute(sql, args, False))
+
+    async def executemany(self, sql, seq_of_args):
+        return await self._run(self._execute(sql, seq_of_args, True))
+
+    async def commit(self):
+        await self._run(self._conn.commit())
+
+    async def rollback(self):
+        await self._run(self._conn.rollback())
+
+    async def savepoint(self, name):
+        await self._run(self._command(f"SAVEPOINT {name}"))
+
+    async def rollback_to_savepoint(self, name):
+        await self._run(self._command(f"ROLLBACK TO SAVEPOINT {name}"))
+
+    async def _run(self, coro):
+        try:
+            return await asyncio.wait_for(coro, self._timeout)
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            raise query_timeout_error()
+
+    async def _command(self, sql):
+        async with self._conn.cursor() as cursor:
+            await cursor.execute(sql)
+
+    async def _fetch(self, sql, args, many, dictionary):
+        async with self._conn.cursor(aiomysql.DictCursor if dictionary else aiomysql.Cursor) as cursor:
+            await cursor.execute(sql, args)
+            return await (cursor.fetchall() if many else cursor.fetchone())
+
+    async def _execute(self, sql, args, many):
+        async with self._conn.cursor() as cursor:
+            try:
+                if many:
+                    await cursor.executemany(sql, args)
+                else:
+                    await cursor.execute(sql, args)
+            except aiomysql.IntegrityError as e:
+                if is_duplicate_key(e):
+                    raise DuplicateKeyError(str(e))
+                raise
+            return ExecuteResult(cursor.rowcount, cursor.lastrowid)
+
+
+class AsyncEngine(Engine):
+    name = "async"
+
+    def __init__(self, db_config, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, borrow_timeout=DB_POOL_BORROW_TIMEOUT):
+        if aiomysql is None:
+            raise RuntimeError("DB_ENGINE=async requires the aiomysql package")
+        self._db_config = db_config
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.idle_timeout = idle_timeout
+        self.borrow_timeout = borrow_timeout
+        self.health = DatabaseHealth()
+        self.pool = None
+
+    async def open(self):
+        try:
+            self.pool = await self._create_pool(self.min_size)
+        except (aiomysql.OperationalError, OSError) as e:
+            # Leave connections to be created lazily once the database is reachable
+            logger.warning(f"Could not pre-create pooled connections: {str(e)}")
+            self.pool = await self._create_pool(0)
+        logger.info(f"Async database pool opened with {self.pool.size} connections (max {self.max_size})")
+
+    async def _create_pool(self, min_size):
+        return await aiomysql.create_pool(
+            host=self._db_config["host"],
+            port=self._db_config["port"],
+            user=self._db_config["user"],
+            password=self._db_config["password"],
+            db=self._db_config["database"],
+            connect_timeout=self._db_config.get("connect_timeout", 10),
+            client_flag=self._db_config.get("client_flag", 0),
+            # aiomysql has no read timeout; queries are bounded by AsyncSession
+            minsize=min_size,
+            maxsize=self.max_size,
+            pool_recycle=int(self.idle_timeout),
+            autocommit=False,
+        )
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+
+    @asynccontextmanager
+    async def session(self, readonly=False, key=None):
+        conn = await acquire_with_backoff(self._acquire, (aiomysql.OperationalError, OSError), self.health)
+        session = AsyncSession(conn)
+        try:
+            yield session
+        finally:
+            if session.timed_out or session.stream_open:
+                # Connection state is unknown after a cancelled query, or
+                # unread rows of an abandoned stream are still pending
+                conn.close()
+            else:
+                # End any open transaction before the connection goes back to the pool
+                try:
+                    await conn.rollback()
+                except Exception:
+                    conn.close()
+            self.pool.release(conn)
+
+    async def _acquire(self, remaining):
+        try:
+            return await asyncio.wait_for(self.pool.acquire(), min(remaining, self.borrow_timeout))
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Timed out waiting for a database connection"
+            )
+
+    def stats(self):
+        pool = {}
+        if self.pool is not None:
+            pool = {
+                "size": self.pool.size,
+                "idle": self.pool.freesize,
+                "in_use": self.pool.size - self.pool.freesize,
+                "min_size": self.pool.minsize,
+                "max_size": self.pool.maxsize,
+            }
+        return {"engine": self.name, "pool": pool, "health": self.health.stats()}
+
+
+def create_engine(connect, db_config, engine=DB_ENGINE, replica_hosts=DB_REPLICA_HOSTS):
+    """
+    Build the database engine selected by DB_ENGINE. connect(config) opens a
+    mariadb connection for the threaded engine. When DB_REPLICA_HOSTS is set
+    the primary and one engine per replica are wrapped in a RoutingEngine.
+    """
+    if engine not in ("threaded", "async"):
+        raise ValueError(f"Unknown DB_ENGINE: {engine}")
+
+    def build(config):
+        if engine == "async":
+            return AsyncEngine(config)
+        return ThreadedEngine(lambda: connect(config))
+
+    primary = build(db_config)
+    replicas = [
+        build({**db_config, "host": host, "port": port})
+        for host, port in parse_replica_hosts(replica_hosts, db_config["port"])
+    ]
+    if not replicas:
+        return primary
+    logger.info(f"Routing reads to {len(replicas)} replica(s)")
+    return RoutingEngine(primary, replicas)
@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+# Threads available for blocking database calls (per uvicorn worker process).
+# Sessions wait for a connection on the event loop (ThreadedEngine holds one
+# permit per pool connection), so a pool.acquire() job always finds an idle
+# connection or room for a new one and threads are only held by queries,
+# whatever the number of concurrent sessions.
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "10"))
+DB_EXECUTOR_MAX_QUEUE = int(os.getenv("DB_EXECUTOR_MAX_QUEUE", "500"))  # Calls allowed to wait for a thread
+
+
+class _Job:
+    __slots__ = ("submitted_at", "dequeued")
+
+    def __init__(self):
+        self.submitted_at = time.monotonic()
+        self.dequeued = False  # Set once by whichever of _call or a cancellation gets there first
+
+
+class DBExecutor:
+    """
+    Runs blocking database calls on a bounded thread pool so that async
+    handlers can await them without stalling the event loop.
+    """
+
+    def __init__(self, max_workers=DB_EXECUTOR_WORKERS, max_queue=DB_EXECUTOR_MAX_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0,
+                       "max_queued": 0, "total_wait": 0.0, "total_run": 0.0}
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on a database thread and return its result."""
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Database is overloaded, try again later"
+                )
+            self._queued += 1
+            self._stats["submitted"] += 1
+            self._stats["max_queued"] = max(self._stats["max_queued"], self._queued)
+
+        job = _Job()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._call, job, fn, args)
+        except asyncio.CancelledError:
+            # A job cancelled (e.g. by a query timeout) before a thread picked
+            # it up never reaches _call, so take it off the queue here
+            with self._lock:
+                if not job.dequeued:
+                    job.dequeued = True
+                    self._queued -= 1
+            raise
+
+    def _call(self, job, fn, args):
+        started_at = time.monotonic()
+        with self._lock:
+            if job.dequeued:
+                return None  # Its caller was cancelled before the job started
+            job.dequeued = True
+            self._queued -= 1
+            self._active += 1
+            self._stats["total_wait"] += started_at - job.submitted_at
+        ok = False
+        try:
+            result = fn(*args)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._stats["completed" if ok else "failed"] += 1
+                self._stats["total_run"] += time.monotonic() - started_at
+
+    def stats(self):
+        with self._lock:
+            done = self._stats["completed"] + self._stats["failed"]
+            return {
+                "workers": self.max_workers,
+                "queued": self._queued,
+                "active": self._active,
+                "max_queue": self.max_queue,
+                "submitted": self._stats["submitted"],
+                "completed": self._stats["completed"],
+                "failed": self._stats["failed"],
+                "rejected": self._stats["rejected"],
+                "max_queued": self._stats["max_queued"],
+                "avg_wait_ms": round(self._stats["total_wait"] / done * 1000, 3) if done else 0.0,
+                "avg_run_ms": round(self._stats["total_run"] / done * 1000, 3) if done else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,115 @@
+import os
+import time
+import random
+import asyncio
+import logging
+
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "3"))         # Seconds per connection attempt
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", "10"))          # Seconds a single query may run
+DB_ACQUIRE_DEADLINE = float(os.getenv("DB_ACQUIRE_DEADLINE", "5"))     # Total seconds spent getting a connection
+DB_RETRY_BASE_DELAY = float(os.getenv("DB_RETRY_BASE_DELAY", "0.05"))  # First backoff step
+DB_RETRY_MAX_DELAY = float(os.getenv("DB_RETRY_MAX_DELAY", "1"))       # Backoff cap
+DB_DOWN_COOLDOWN = float(os.getenv("DB_DOWN_COOLDOWN", "5"))           # Seconds to fail fast once the DB is down
+
+
+class DatabaseHealth:
+    """
+    Remembers that the database is unreachable so requests can fail in
+    microseconds instead of each one waiting out its own retries.
+
+    After a failed acquisition the database is marked down for cooldown
+    seconds. Once that passes a single caller is let through to probe it;
+    everyone else keeps failing fast until the probe succeeds or fails.
+    """
+
+    def __init__(self, cooldown=DB_DOWN_COOLDOWN):
+        self.cooldown = cooldown
+        self._down_until = 0.0
+        self._probing = False
+        self._last_error = None
+        self._stats = {"failures": 0, "fast_failures": 0}
+
+    def check(self):
+        """Raise 503 right away if the database is known to be down."""
+        if not self._down_until:
+            return False
+        if time.monotonic() < self._down_until or self._probing:
+            self._stats["fast_failures"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Database unavailable: {self._last_error}"
+            )
+        # Cooldown is over, this caller probes the database
+        self._probing = True
+        return True
+
+    def record_success(self):
+        if self._down_until:
+            logger.info("✅ Database reachable again.")
+        self._down_until = 0.0
+        self._probing = False
+
+    def record_failure(self, error):
+        if not self._down_until:
+            logger.warning(f"❌ Database unreachable, failing fast for {self.cooldown}s: {error}")
+        self._down_until = time.monotonic() + self.cooldown
+        self._probing = False
+        self._last_error = str(error)
+        self._stats["failures"] += 1
+
+    def end_probe(self):
+        self._probing = False
+
+    @property
+    def available(self):
+        """False while check() would fail fast."""
+        if not self._down_until:
+            return True
+        return time.monotonic() >= self._down_until and not self._probing
+
+    def stats(self):
+        return {
+            "available": self.available,
+            "last_error": self._last_error,
+            **self._stats,
+        }
+
+
+async def acquire_with_backoff(acquire, retryable, health, deadline=DB_ACQUIRE_DEADLINE):
+    """
+    Await acquire(remaining_seconds) until it returns a connection, retrying
+    errors of the retryable type(s) with full-jitter exponential backoff. Gives
+    up with a 503 once deadline seconds have passed and marks the database
+    down in health.
+    """
+    probe = health.check()
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + deadline
+    attempt = 0
+
+    try:
+        while True:
+            try:
+                conn = await acquire(max(give_up_at - loop.time(), 0.0))
+            except retryable as e:
+                attempt += 1
+                delay = random.uniform(0, min(DB_RETRY_MAX_DELAY, DB_RETRY_BASE_DELAY * 2 ** attempt))
+                if loop.time() + delay >= give_up_at:
+                    health.record_failure(e)
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail=f"Database unavailable: {str(e)}"
+                    )
+                logger.info(f"Database connection attempt {attempt} failed, retrying in {delay:.3f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+            health.record_success()
+            return conn
+    finally:
+        # A probe that ended in anything but success/failure (e.g. pool exhausted) frees the slot
+        if probe:
+            health.end_probe()
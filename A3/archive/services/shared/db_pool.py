@@ -0,0 +1,199 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+import mariadb
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+# Pool sizing (per uvicorn worker process)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))     # Seconds before an idle connection is closed
+DB_POOL_BORROW_TIMEOUT = float(os.getenv("DB_POOL_BORROW_TIMEOUT", "5"))   # Seconds to wait for a free connection
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "1"))           # Ping connections idle for longer than this
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MariaDB connections.
+
+    Connections are created lazily up to max_size, returned to the pool on
+    release and closed once they have been idle for longer than idle_timeout
+    (never going below min_size). A connection that has been idle for longer
+    than ping_after is pinged before it is handed out, so dead connections
+    are replaced instead of failing the request. on_close(connection) is
+    called before a connection is closed so per-connection state (e.g. the
+    prepared statement cache) can be dropped.
+    """
+
+    def __init__(self, connect, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, borrow_timeout=DB_POOL_BORROW_TIMEOUT,
+                 ping_after=DB_POOL_PING_AFTER, on_close=None):
+        self._connect = connect
+        self._on_close = on_close
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.idle_timeout = idle_timeout
+        self.borrow_timeout = borrow_timeout
+        self.ping_after = ping_after
+
+        self._idle = deque()  # (connection, released_at), most recently used on the right
+        self._size = 0        # Idle + borrowed connections
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._stats = {"borrowed": 0, "created": 0, "reaped": 0, "broken": 0, "timeouts": 0}
+
+    def open(self):
+        """Pre-create min_size connections."""
+        with self._cond:
+            self._closed = False
+        for _ in range(self.min_size):
+            with self._cond:
+                self._size += 1
+            try:
+                conn = self._create()
+            except Exception as e:
+                # Leave the rest to be created lazily once the database is reachable
+                logger.warning(f"Could not pre-create pooled connection: {str(e)}")
+                break
+            self.release(conn)
+        logger.info(f"Database pool opened with {self._size} connections (max {self.max_size})")
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def acquire(self, timeout=None):
+        """
+        Borrow a connection, waiting up to timeout (default borrow_timeout)
+        seconds for one to become free.
+        """
+        timeout = self.borrow_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            conn, released_at = self._checkout(deadline)
+            if conn is None:
+                # Pool had room, open a new connection outside the lock
+                conn = self._create()
+                self._stats["borrowed"] += 1
+                return conn
+
+            if time.monotonic() - released_at > self.ping_after:
+                try:
+                    conn.ping()
+                except mariadb.Error as e:
+                    logger.warning(f"Discarding broken pooled connection: {str(e)}")
+                    self._discard(conn)
+                    self._stats["broken"] += 1
+                    continue
+
+            self._stats["borrowed"] += 1
+            return conn
+
+    def release(self, conn, discard=False):
+        """Return a borrowed connection, ending any open transaction."""
+        if not discard:
+            try:
+                conn.rollback()
+            except mariadb.Error:
+                discard = True
+
+        if discard:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                **self._stats,
+            }
+
+    def _checkout(self, deadline):
+        """
+        Return (connection, released_at) for an idle connection, or
+        (None, None) after reserving a slot for a new connection.
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="Database pool is closed"
+                    )
+                self._reap_idle()
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="Timed out waiting for a database connection"
+                    )
+                self._cond.wait(remaining)
+
+    def _reap_idle(self):
+        # Oldest connections sit on the left; stop at the first one still fresh
+        now = time.monotonic()
+        while len(self._idle) and self._size > self.min_size:
+            conn, released_at = self._idle[0]
+            if now - released_at < self.idle_timeout:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self._stats["reaped"] += 1
+            self._close_quietly(conn)
+
+    def _create(self):
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        self._close_quietly(conn)
+
+    def _close_quietly(self, conn):
+        try:
+            if self._on_close is not None:
+                self._on_close(conn)
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,198 @@
+import os
+import math
+import time
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+DB_REPLICA_HOSTS = os.getenv("DB_REPLICA_HOSTS", "")                                 # "host[:port],host[:port]"
+DB_READ_YOUR_WRITES_WINDOW = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", "5"))     # Seconds reads of a written key stay on the primary
+DB_READ_YOUR_WRITES_MAX_KEYS = int(os.getenv("DB_READ_YOUR_WRITES_MAX_KEYS", "100000"))
+DB_WRITE_COOKIE = "db_written_at"                                                   # Time of the client's last write, see track_client_writes
+
+# The current request's {"written_at": time of the client's last write (from
+# its cookie), "wrote": whether this request wrote}; None outside a request
+_client_writes = contextvars.ContextVar("client_writes", default=None)
+
+
+def parse_replica_hosts(value, default_port):
+    """Parse "host[:port],..." into a list of (host, port)."""
+    hosts = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(":")
+        hosts.append((host, int(port) if port else default_port))
+    return hosts
+
+
+async def track_client_writes(request, call_next):
+    """
+    HTTP middleware that carries read-your-writes across workers and pods.
+    RecentWrites only knows the writes of its own worker, so the response to
+    a request that wrote also sets the DB_WRITE_COOKIE cookie; while it is
+    younger than DB_READ_YOUR_WRITES_WINDOW every read of that client goes to
+    the primary, whichever worker or replica serves it. The BFFs run it too
+    and relay the cookie between the client and the services.
+    """
+    try:
+        written_at = float(request.cookies.get(DB_WRITE_COOKIE, 0))
+    except ValueError:
+        written_at = 0.0
+    state = {"written_at": written_at, "wrote": False}
+    _client_writes.set(state)
+    response = await call_next(request)
+    if state["wrote"]:
+        response.set_cookie(DB_WRITE_COOKIE, f"{state['written_at']:.3f}",
+                            max_age=math.ceil(DB_READ_YOUR_WRITES_WINDOW), httponly=True)
+    return response
+
+
+def mark_client_write():
+    """Record that the current request wrote, so its response sets the cookie."""
+    state = _client_writes.get()
+    if state is not None:
+        state["written_at"] = time.time()
+        state["wrote"] = True
+
+
+def client_wrote_recently(window=DB_READ_YOUR_WRITES_WINDOW):
+    """Whether the current request's client wrote in the last window seconds."""
+    state = _client_writes.get()
+    return state is not None and time.time() - state["written_at"] < window
+
+
+def client_write_cookie():
+    """Cookie header passing the current client's write time on to a service, or None."""
+    if not client_wrote_recently():
+        return None
+    return f"{DB_WRITE_COOKIE}={_client_writes.get()['written_at']:.3f}"
+
+
+class RecentWrites:
+    """Keys written in the last window seconds (per worker process)."""
+
+    def __init__(self, window=DB_READ_YOUR_WRITES_WINDOW, max_keys=DB_READ_YOUR_WRITES_MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self._expires = {}  # key -> monotonic expiry, insertion ordered
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+            self._expires[key] = time.monotonic() + self.window
+            self._prune()
+
+    def __contains__(self, key):
+        expiry = self._expires.get(key)
+        return expiry is not None and expiry > time.monotonic()
+
+    def __len__(self):
+        return len(self._expires)
+
+    def _prune(self):
+        # Entries are ordered by expiry, so drop from the front
+        now = time.monotonic()
+        while self._expires:
+            key, expiry = next(iter(self._expires.items()))
+            if expiry > now and len(self._expires) <= self.max_keys:
+                break
+            del self._expires[key]
+
+
+class RoutingEngine:
+    """
+    Sends reads to replica engines and writes to the primary engine.
+
+    Reads are spread round-robin over the replicas that are not known to be
+    down, falling back to the primary when none are available or the chosen
+    replica turns out to be unreachable. A read goes to the primary if its
+    key was written through this worker, or its client wrote anything (see
+    track_client_writes), in the last DB_READ_YOUR_WRITES_WINDOW seconds, so
+    a client never reads back data older than its own write because of
+    replica lag. key may also be a list of keys for multi-row reads.
+    """
+
+    name = "routing"
+
+    def __init__(self, primary, replicas, recent_writes=None):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.recent_writes = recent_writes or RecentWrites()
+        self._next_replica = itertools.cycle(range(len(self.replicas)))
+        self._stats = {"primary_reads": 0, "replica_reads": 0, "read_your_writes": 0, "replica_fallbacks": 0,
+                       "writes": 0}
+
+    async def open(self):
+        await self.primary.open()
+        for replica in self.replicas:
+            await replica.open()
+
+    async def close(self):
+        for replica in self.replicas:
+            await replica.close()
+        await self.primary.close()
+
+    def session(self, readonly=False, key=None):
+        if not readonly:
+            self._stats["writes"] += 1
+            return self.primary.session()
+        if client_wrote_recently(self.recent_writes.window) or (key is not None and self._recently_written(key)):
+            self._stats["read_your_writes"] += 1
+            self._stats["primary_reads"] += 1
+            return self.primary.session()
+        replica = self._pick_replica()
+        if replica is None:
+            self._stats["primary_reads"] += 1
+            return self.primary.session()
+        self._stats["replica_reads"] += 1
+        return self._replica_session(replica)
+
+    @asynccontextmanager
+    async def _replica_session(self, replica):
+        async with AsyncExitStack() as stack:
+            try:
+                session = await stack.enter_async_context(replica.session())
+            except HTTPException as e:
+                if e.status_code != status.HTTP_503_SERVICE_UNAVAILABLE:
+                    raise
+                # The replica went down before its health noticed (it is
+                # marked now); this read can still be served by the primary
+                self._stats["replica_fallbacks"] += 1
+                logger.warning(f"Replica unavailable, reading from the primary: {e.detail}")
+                session = await stack.enter_async_context(self.primary.session())
+            yield session
+
+    def mark_written(self, *keys):
+        for key in keys:
+            self.recent_writes.add(key)
+        mark_client_write()
+
+    def _recently_written(self, key):
+        if isinstance(key, (list, tuple, set)):
+            return any(k in self.recent_writes for k in key)
+        return key in self.recent_writes
+
+    def _pick_replica(self):
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next_replica)]
+            if replica.health.available:
+                return replica
+        return None
+
+    def stats(self):
+        return {
+            "engine": self.name,
+            "primary": self.primary.stats(),
+            "replicas": [replica.stats() for replica in self.replicas],
+            "recent_writes": len(self.recent_writes),
+            **self._stats,
+        }
@@ -0,0 +1,51 @@
+import hashlib
+
+from fastapi import Response, status
+
+from .fast_json import dumps
+
+
+def compute_etag(body):
+    """Strong ETag of a response body: any change to the bytes changes the tag."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _opaque_tag(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches etag (weak comparison, as RFC 9110 asks for)."""
+    if not if_none_match or etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = _opaque_tag(etag)
+    return any(_opaque_tag(tag) == etag for tag in if_none_match.split(","))
+
+
+def not_modified(etag):
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+def document_etag(content):
+    """The ETag etag_response() would send for content, e.g. to cache it alongside."""
+    return compute_etag(dumps(content))
+
+
+def etag_response(content, if_none_match, etag=None):
+    """
+    JSON response for content with its ETag, or an empty 304 when
+    if_none_match already names it. Passing a known etag (e.g. cached with
+    the document) lets a 304 skip serializing content altogether.
+    """
+    body = None
+    if etag is None:
+        body = dumps(content)
+        etag = compute_etag(body)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    if body is None:
+        body = dumps(content)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
@@ -0,0 +1,42 @@
+import io
+import csv
+
+from .fast_json import dumps
+from .repositories import BOOK_COLUMNS
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def ndjson_chunk(rows):
+    """Encode rows as newline-delimited JSON, one object per line."""
+    return b"".join(dumps(row) + b"\n" for row in rows)
+
+
+def csv_chunk(rows, columns=BOOK_COLUMNS, header=False):
+    """Encode rows as CSV lines, optionally preceded by the header line."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore", lineterminator="\n")
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+async def encode_export(batches, fmt):
+    """
+    Turn an async iterator of row batches into encoded chunks for a
+    StreamingResponse; each batch becomes one chunk.
+    """
+    first = True
+    async for rows in batches:
+        if fmt == "csv":
+            yield csv_chunk(rows, header=first)
+        else:
+            yield ndjson_chunk(rows)
+        first = False
+    if first and fmt == "csv":
+        # Empty table: still send the header
+        yield csv_chunk([], header=True)
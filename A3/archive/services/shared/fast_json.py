@@ -0,0 +1,52 @@
+import json
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library (slower, same output)
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if orjson is None and hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """
+    Serialize to compact JSON bytes. Decimal (e.g. price) becomes a number,
+    datetimes ISO 8601 strings and pydantic models their fields.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class of the services and BFFs, rendered with dumps()."""
+
+    def render(self, content):
+        return dumps(content)
+
+
+def json_response(content, status_code=200, headers=None):
+    """
+    Return content without FastAPI's response_model validation and
+    jsonable_encoder pass, e.g. rows read by the repositories, which are
+    already well-formed.
+    """
+    return FastJSONResponse(content=content, status_code=status_code, headers=headers)
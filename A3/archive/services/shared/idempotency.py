@@ -0,0 +1,133 @@
+import os
+import asyncio
+import hashlib
+
+from fastapi import HTTPException, Response, status
+
+from .cache import create_cache_backend
+from .cache_client import CacheUnavailableError
+from .fast_json import dumps
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))                  # Seconds a stored result is replayed
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))         # Oldest results are dropped beyond this
+IDEMPOTENCY_PENDING_TTL = float(os.getenv("IDEMPOTENCY_PENDING_TTL", "60"))     # Seconds a claim outlives a worker that died mid-request
+IDEMPOTENCY_POLL_INTERVAL = 0.05                                                # Seconds between checks on another worker's request
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Response headers kept with a stored result
+REPLAYED_HEADERS = ("location",)
+
+
+class IdempotencyStore:
+    """
+    Remembers the response to a POST sent with an Idempotency-Key header so
+    a retry of the same request gets the same response without running the
+    handler again: no second insert and no second Kafka event.
+
+    Keys are scoped per endpoint. Only successful responses are stored; if
+    the first request fails its key is freed and a retry runs normally. A
+    retry that arrives while the first request is still running waits for
+    it. Reusing a key with a different body is rejected with 422.
+
+    Results live for ttl seconds in the backend, by default the one from
+    create_cache_backend(), which only the workers of one container share.
+    Services with several replicas pass an IdempotencyRepository so that a
+    retry reaching another replica finds the key too. A key is claimed with
+    an atomic add before the handler runs; a retry on another worker polls
+    until the claim turns into a result or is freed.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_keys=IDEMPOTENCY_MAX_KEYS, backend=None):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._backend = backend if backend is not None else create_cache_backend("idempotency", max_keys)
+        self._running = {}  # entry key -> future resolved when this worker's request finishes
+        self._stats = {"stored": 0, "replayed": 0, "waited": 0, "conflicts": 0}
+
+    async def run(self, scope, key, request, handler):
+        """
+        Return the stored response for (scope, key), or await handler() (which
+        must return a Response) and store its result. Without a key this is
+        just handler().
+        """
+        if not key:
+            return await handler()
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters"
+            )
+
+        entry_key = f"{scope} {key}"
+        fingerprint = hashlib.sha256(dumps(request)).hexdigest()
+        waited = False
+        while not await self._claim(entry_key, fingerprint):
+            entry = await self._backend.get(entry_key)
+            if entry is None:
+                continue  # Freed or expired since the add; try to claim it again
+            if entry["fingerprint"] != fingerprint:
+                self._stats["conflicts"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Idempotency-Key was already used for a different request"
+                )
+            if "status" in entry:
+                self._stats["replayed"] += 1
+                return self._replay(entry)
+            # The first request is still running; wait for it and look again
+            if not waited:
+                self._stats["waited"] += 1
+                waited = True
+            running = self._running.get(entry_key)
+            if running is not None:
+                await asyncio.shield(running)
+            else:
+                await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+        running = asyncio.get_running_loop().create_future()
+        self._running[entry_key] = running
+        try:
+            try:
+                response = await handler()
+            except BaseException:
+                await self._backend.delete(entry_key)
+                raise
+
+            if 200 <= response.status_code < 300:
+                headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+                await self._backend.set(entry_key, {
+                    "fingerprint": fingerprint,
+                    "status": response.status_code,
+                    "body": response.body.decode(),
+                    "headers": headers,
+                }, self.ttl)
+                self._stats["stored"] += 1
+            else:
+                await self._backend.delete(entry_key)
+            return response
+        finally:
+            del self._running[entry_key]
+            running.set_result(None)
+
+    async def _claim(self, entry_key, fingerprint):
+        # Without a confirmed claim another worker may be running the same
+        # request, so refuse rather than risk running it twice
+        try:
+            return await self._backend.add(entry_key, {"fingerprint": fingerprint}, IDEMPOTENCY_PENDING_TTL)
+        except CacheUnavailableError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Idempotency-Key cannot be checked right now, try again later"
+            )
+
+    @staticmethod
+    def _replay(entry):
+        return Response(
+            content=entry["body"],
+            status_code=entry["status"],
+            headers={**entry["headers"], "Idempotent-Replayed": "true"},
+            media_type="application/json"
+        )
+
+    def stats(self):
+        return {"ttl": self.ttl, **self._stats, **self._backend.stats()}
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, constr, condecimal, conint, EmailStr, validator
-from typing import Optional
+from typing import List, Optional
 
 class Book(BaseModel):
     ISBN: constr(min_length=10, max_length=20)
@@ -23,6 +23,14 @@ class Book(BaseModel):
             }
         }
 
+# Request body for resolving many books at once (POST /books/lookup)
+class BookLookup(BaseModel):
+    isbn: List[str]
+
+# Request body for POST /books/{ISBN}/reserve and /release
+class StockChange(BaseModel):
+    quantity: conint(gt=0) = 1
+
 class CustomerBase(BaseModel):
     userId: EmailStr
     name: str
@@ -70,6 +78,12 @@ class MobileCustomerResponse(BaseModel):
     name: str
     phone: str 
     
+# Request body for resolving many customers at once (POST /customers/lookup);
+# exactly one of id / userId is given
+class CustomerLookup(BaseModel):
+    id: Optional[List[int]] = None
+    userId: Optional[List[str]] = None
+
 class RelatedBook(BaseModel):
     title: str
     authors: str
@@ -0,0 +1,375 @@
+import os
+import time
+import hashlib
+
+from .db_engine import DuplicateKeyError
+from .fast_json import dumps, loads
+from .row_mapper import RowMapper
+
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "60"))   # Seconds between sweeps of expired keys
+IDEMPOTENCY_PURGE_BATCH = 1000
+
+
+def book_key(isbn):
+    return f"book:{isbn}"
+
+
+def customer_key(id_or_user_id):
+    return f"customer:{id_or_user_id}"
+
+
+BOOK_COLUMNS = ("ISBN", "title", "Author", "description", "genre", "price", "quantity")
+CUSTOMER_COLUMNS = ("id", "userId", "name", "phone", "address", "address2", "city", "state", "zipcode")
+
+# Reads select these columns as tuples and map them with precompiled mappers
+BOOK_ROW = RowMapper(BOOK_COLUMNS)
+BOOK_SEARCH_ROW = RowMapper(BOOK_COLUMNS + ("score",))
+CUSTOMER_ROW = RowMapper(CUSTOMER_COLUMNS)
+
+SELECT_BOOKS = f"SELECT {BOOK_ROW.select_list} FROM Books"
+SELECT_CUSTOMERS = f"SELECT {CUSTOMER_ROW.select_list} FROM Customers"
+
+INSERT_BOOK = "INSERT INTO Books (ISBN, title, Author, description, genre, price, quantity) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+
+INSERT_MANY_SAVEPOINT = "insert_many"
+
+SEARCH_MATCH = "MATCH (title, Author, description) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+
+
+def in_clause(values):
+    """
+    Return ("%s, %s, ...", args) for an IN list. The list is padded (by
+    repeating the last value) to the next power of two so that lists of
+    different lengths share a handful of prepared statements.
+    """
+    values = tuple(values)
+    size = 1
+    while size < len(values):
+        size *= 2
+    padded = values + (values[-1],) * (size - len(values))
+    return ", ".join(["%s"] * size), padded
+
+
+def book_params(book):
+    return (book.ISBN, book.title, book.Author, book.description, book.genre, float(book.price), book.quantity)
+
+
+class Repository:
+    """
+    Base class for the SQL repositories. Queries go through a session from
+    the configured database engine (see db_engine), so the same repository
+    code serves both the threaded and the async engine.
+
+    Reads open readonly sessions keyed by the entity they look up so the
+    engine can route them to a replica; writes report the keys they touched
+    with mark_written() so reads of those keys stay on the primary for a
+    short while.
+
+    Single-row writes go through _write(), which hands them to the write
+    coalescer (see write_coalescer) when one is configured so that bursts
+    of writes share a commit.
+    """
+
+    def __init__(self, engine, coalescer=None):
+        self._engine = engine
+        self._coalescer = coalescer
+
+    async def _write(self, operation):
+        """
+        Run operation(session) and commit, either in a transaction of its own
+        or batched with concurrent writes. operation must not commit.
+        """
+        if self._coalescer is not None:
+            return await self._coalescer.submit(operation)
+        async with self._engine.session() as session:
+            result = await operation(session)
+            await session.commit()
+        return result
+
+
+class BookRepository(Repository):
+    async def get(self, isbn):
+        async with self._engine.session(readonly=True, key=book_key(isbn)) as session:
+            row = await session.fetchone(f"{SELECT_BOOKS} WHERE ISBN = %s", (isbn,), dictionary=False)
+        return BOOK_ROW.to_dict(row) if row else None
+
+    async def get_many(self, isbns):
+        """Fetch several books with one IN query. Returns {ISBN.upper(): row}."""
+        isbns = list(dict.fromkeys(isbns))
+        placeholders, args = in_clause(isbns)
+        async with self._engine.session(readonly=True, key=[book_key(isbn) for isbn in isbns]) as session:
+            rows = await session.fetchall(f"{SELECT_BOOKS} WHERE ISBN IN ({placeholders})", args, dictionary=False)
+        return {row[0].upper(): BOOK_ROW.to_dict(row) for row in rows}
+
+    async def list(self, after=None, limit=20, genre=None, author=None, min_price=None, max_price=None):
+        """
+        Return up to limit books ordered by ISBN, starting after the ISBN
+        cursor. Paging by "ISBN > cursor" rather than OFFSET lets the primary
+        key, or the (genre, ISBN) / (Author, ISBN) index for those filters,
+        seek straight to the page, so deep pages cost the same as the first
+        one. A price range only narrows the rows; its matches are sorted by
+        ISBN before the page is cut.
+        """
+        conditions, args = [], []
+        if genre is not None:
+            conditions.append("genre = %s")
+            args.append(genre)
+        if author is not None:
+            conditions.append("Author = %s")
+            args.append(author)
+        if min_price is not None:
+            conditions.append("price >= %s")
+            args.append(float(min_price))
+        if max_price is not None:
+            conditions.append("price <= %s")
+            args.append(float(max_price))
+        if after is not None:
+            conditions.append("ISBN > %s")
+            args.append(after)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        args.append(limit)
+        async with self._engine.session(readonly=True) as session:
+            rows = await session.fetchall(f"{SELECT_BOOKS} {where}ORDER BY ISBN LIMIT %s", tuple(args), dictionary=False)
+        return BOOK_ROW.to_dicts(rows)
+
+    async def search(self, query, limit=20, offset=0):
+        """
+        Full-text search over title, Author and description, best matches
+        first. Uses the ft_books_search FULLTEXT index; the score is the
+        MATCH relevance and ties are broken by ISBN so paging is stable.
+        """
+        async with self._engine.session(readonly=True) as session:
+            rows = await session.fetchall(
+                f"""SELECT {BOOK_ROW.select_list}, {SEARCH_MATCH} AS score FROM Books
+                    WHERE {SEARCH_MATCH}
+                    ORDER BY score DESC, ISBN LIMIT %s OFFSET %s""",
+                (query, query, limit, offset), dictionary=False
+            )
+        return BOOK_SEARCH_ROW.to_dicts(rows)
+
+    async def export(self, batch_size=1000):
+        """Yield every book, ordered by ISBN, in lists of up to batch_size rows."""
+        async with self._engine.session(readonly=True) as session:
+            async for rows in session.stream(f"{SELECT_BOOKS} ORDER BY ISBN", (), batch_size):
+                yield rows
+
+    async def insert(self, book):
+        """Insert a book in one statement. Returns False if the ISBN already exists."""
+        async def insert(session):
+            try:
+                await session.execute(INSERT_BOOK, book_params(book))
+            except DuplicateKeyError:
+                return False
+            return True
+
+        inserted = await self._write(insert)
+        if inserted:
+            self._engine.mark_written(book_key(book.ISBN))
+        return inserted
+
+    async def insert_many(self, books):
+        """
+        Insert books (distinct ISBNs) in one transaction with executemany.
+        Returns the set of ISBNs that already existed and were skipped.
+        """
+        if not books:
+            return set()
+        isbns = tuple(book.ISBN for book in books)
+        placeholders, args = in_clause(isbns)
+        async with self._engine.session() as session:
+            rows = await session.fetchall(f"SELECT ISBN FROM Books WHERE ISBN IN ({placeholders})", args)
+            existing = {row["ISBN"] for row in rows}
+            new_books = [book for book in books if book.ISBN not in existing]
+            if new_books:
+                await session.savepoint(INSERT_MANY_SAVEPOINT)
+                try:
+                    await session.executemany(INSERT_BOOK, [book_params(book) for book in new_books])
+                except DuplicateKeyError:
+                    # A concurrent writer got in between. executemany may have
+                    # inserted some rows before the duplicate, so undo all of
+                    # them and fall back to row-by-row for this chunk
+                    await session.rollback_to_savepoint(INSERT_MANY_SAVEPOINT)
+                    for book in new_books:
+                        try:
+                            await session.execute(INSERT_BOOK, book_params(book))
+                        except DuplicateKeyError:
+                            existing.add(book.ISBN)
+            await session.commit()
+        self._engine.mark_written(*(book_key(isbn) for isbn in isbns if isbn not in existing))
+        return existing
+
+    async def reserve(self, isbn, quantity):
+        """
+        Take quantity copies out of stock with one conditional UPDATE, so
+        concurrent orders cannot oversell or lose updates. Returns
+        (reserved, stock): the stock left after a reservation, the current
+        stock if there were not enough copies, or None if no book has this
+        ISBN.
+        """
+        return await self._adjust_stock(
+            """UPDATE Books SET quantity = LAST_INSERT_ID(quantity - %s)
+               WHERE ISBN = %s AND quantity >= %s""",
+            (quantity, isbn, quantity), isbn
+        )
+
+    async def release(self, isbn, quantity):
+        """Put quantity copies back into stock. Returns (released, stock) like reserve()."""
+        return await self._adjust_stock(
+            "UPDATE Books SET quantity = LAST_INSERT_ID(quantity + %s) WHERE ISBN = %s",
+            (quantity, isbn), isbn
+        )
+
+    async def _adjust_stock(self, sql, args, isbn):
+        # LAST_INSERT_ID(expr) hands the new quantity back in the OK packet,
+        # so the row lock is held for one statement and no SELECT is needed
+        async def adjust(session):
+            result = await session.execute(sql, args)
+            if result.rowcount == 0:
+                row = await session.fetchone("SELECT quantity FROM Books WHERE ISBN = %s", (isbn,))
+                return False, row["quantity"] if row else None
+            return True, result.lastrowid or 0
+
+        adjusted, stock = await self._write(adjust)
+        if adjusted:
+            self._engine.mark_written(book_key(isbn))
+        return adjusted, stock
+
+    async def update(self, book):
+        """Update a book in one statement. Returns False if no book has this ISBN."""
+        async def update(session):
+            return await session.execute(
+                """UPDATE Books
+                   SET title = %s, Author = %s, description = %s, genre = %s, price = %s, quantity = %s
+                   WHERE ISBN = %s""",
+                (book.title, book.Author, book.description, book.genre, float(book.price), book.quantity, book.ISBN)
+            )
+
+        result = await self._write(update)
+        self._engine.mark_written(book_key(book.ISBN))
+        # Connections use CLIENT.FOUND_ROWS, so an unchanged row still counts
+        return result.rowcount > 0
+
+
+class CustomerRepository(Repository):
+    async def get_by_id(self, id):
+        async with self._engine.session(readonly=True, key=customer_key(id)) as session:
+            row = await session.fetchone(f"{SELECT_CUSTOMERS} WHERE id = %s", (id,), dictionary=False)
+        return CUSTOMER_ROW.to_dict(row) if row else None
+
+    async def get_by_user_id(self, user_id):
+        async with self._engine.session(readonly=True, key=customer_key(user_id)) as session:
+            row = await session.fetchone(f"{SELECT_CUSTOMERS} WHERE userId = %s", (user_id,), dictionary=False)
+        return CUSTOMER_ROW.to_dict(row) if row else None
+
+    async def get_many_by_id(self, ids):
+        """Fetch several customers with one IN query on the primary key. Returns {id: row}."""
+        rows = await self._get_many("id", list(dict.fromkeys(ids)))
+        return {row["id"]: row for row in rows}
+
+    async def get_many_by_user_id(self, user_ids):
+        """Fetch several customers with one IN query on the userId index. Returns {userId.lower(): row}."""
+        rows = await self._get_many("userId", list(dict.fromkeys(user_ids)))
+        return {row["userId"].lower(): row for row in rows}
+
+    async def _get_many(self, column, values):
+        placeholders, args = in_clause(values)
+        async with self._engine.session(readonly=True, key=[customer_key(v) for v in values]) as session:
+            rows = await session.fetchall(f"{SELECT_CUSTOMERS} WHERE {column} IN ({placeholders})", args, dictionary=False)
+        return CUSTOMER_ROW.to_dicts(rows)
+
+    async def insert(self, customer):
+        """
+        Insert a customer in one statement and return the generated id, or
+        None if the userId already exists. The id comes from the INSERT's OK
+        packet (lastrowid), so no follow-up SELECT is needed; unlike
+        INSERT ... RETURNING this also works on MySQL/Aurora.
+        """
+        async def insert(session):
+            try:
+                result = await session.execute(
+                    """INSERT INTO Customers (userId, name, phone, address, address2, city, state, zipcode)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+                    (customer.userId, customer.name, customer.phone, customer.address,
+                     customer.address2, customer.city, customer.state, customer.zipcode)
+                )
+            except DuplicateKeyError:
+                return None
+            return result.lastrowid
+
+        new_id = await self._write(insert)
+        if new_id is not None:
+            self._engine.mark_written(customer_key(new_id), customer_key(customer.userId))
+        return new_id
+
+
+def idempotency_key_hash(key):
+    # Keys are up to a few hundred characters; the table is keyed by their digest
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class IdempotencyRepository(Repository):
+    """
+    Idempotency-Key records in the IdempotencyKeys table, used as the
+    IdempotencyStore backend so that every replica of a service sees the
+    same claims and results. Same interface as the cache backends; values
+    are stored as JSON. Expiry follows the database clock, so replicas
+    agree on it.
+    """
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self._purged_at = 0.0
+
+    async def get(self, key):
+        async with self._engine.session() as session:
+            row = await session.fetchone(
+                "SELECT value FROM IdempotencyKeys WHERE key_hash = %s AND expires_at > NOW(6)",
+                (idempotency_key_hash(key),), dictionary=False
+            )
+        return loads(row[0]) if row else None
+
+    async def set(self, key, value, ttl):
+        async with self._engine.session() as session:
+            await session.execute(
+                """INSERT INTO IdempotencyKeys (key_hash, value, expires_at)
+                   VALUES (%s, %s, NOW(6) + INTERVAL %s MICROSECOND)
+                   ON DUPLICATE KEY UPDATE value = VALUES(value), expires_at = VALUES(expires_at)""",
+                (idempotency_key_hash(key), dumps(value).decode(), int(ttl * 1_000_000))
+            )
+            await session.commit()
+
+    async def add(self, key, value, ttl):
+        """Insert key unless it holds a live record; True if this call claimed it."""
+        key_hash = idempotency_key_hash(key)
+        async with self._engine.session() as session:
+            # An expired claim or result no longer holds the key
+            await session.execute(
+                "DELETE FROM IdempotencyKeys WHERE key_hash = %s AND expires_at <= NOW(6)", (key_hash,)
+            )
+            if time.monotonic() - self._purged_at > IDEMPOTENCY_PURGE_INTERVAL:
+                self._purged_at = time.monotonic()
+                await session.execute(
+                    "DELETE FROM IdempotencyKeys WHERE expires_at <= NOW(6) LIMIT %s", (IDEMPOTENCY_PURGE_BATCH,)
+                )
+            try:
+                await session.execute(
+                    """INSERT INTO IdempotencyKeys (key_hash, value, expires_at)
+                       VALUES (%s, %s, NOW(6) + INTERVAL %s MICROSECOND)""",
+                    (key_hash, dumps(value).decode(), int(ttl * 1_000_000))
+                )
+            except DuplicateKeyError:
+                await session.rollback()
+                return False
+            await session.commit()
+        return True
+
+    async def delete(self, *keys):
+        if not keys:
+            return
+        placeholders, args = in_clause([idempotency_key_hash(key) for key in keys])
+        async with self._engine.session() as session:
+            await session.execute(f"DELETE FROM IdempotencyKeys WHERE key_hash IN ({placeholders})", args)
+            await session.commit()
+
+    def stats(self):
+        return {"backend": "database"}
@@ -0,0 +1,17 @@
+class RowMapper:
+    """
+    Maps row tuples from a SELECT of columns (in that order) to dicts by
+    zipping them with the column names, which is cheaper per row than a
+    dictionary cursor building each dict key by key.
+    """
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.select_list = ", ".join(self.columns)
+
+    def to_dict(self, row):
+        return dict(zip(self.columns, row))
+
+    def to_dicts(self, rows):
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in rows]
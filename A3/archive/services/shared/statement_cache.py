@@ -0,0 +1,78 @@
+import os
+import threading
+from collections import OrderedDict
+
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "32"))  # Prepared statements kept per connection
+
+
+class StatementCache:
+    """
+    Keeps server-side prepared statements open on each pooled connection.
+
+    A mariadb cursor created with prepared=True prepares its statement on
+    the first execute and re-uses it as long as the same SQL is executed
+    again, so holding one cursor per (connection, SQL) lets repeated lookups
+    skip server-side parsing. Each connection keeps at most max_statements
+    cursors, least recently used ones are closed first.
+    """
+
+    def __init__(self, max_statements=DB_STATEMENT_CACHE_SIZE):
+        self.max_statements = max_statements
+        self._by_conn = {}  # connection -> OrderedDict((sql, dictionary) -> cursor)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def cursor(self, conn, sql, dictionary=False):
+        """Return the prepared cursor for sql on conn, creating it on a miss."""
+        key = (sql, dictionary)
+        with self._lock:
+            statements = self._by_conn.setdefault(conn, OrderedDict())
+            cursor = statements.get(key)
+            if cursor is not None:
+                statements.move_to_end(key)
+                self._stats["hits"] += 1
+                return cursor
+            self._stats["misses"] += 1
+
+        cursor = conn.cursor(prepared=True, dictionary=dictionary)
+        evicted = []
+        with self._lock:
+            statements[key] = cursor
+            while len(statements) > self.max_statements:
+                evicted.append(statements.popitem(last=False)[1])
+                self._stats["evictions"] += 1
+        for old in evicted:
+            self._close_quietly(old)
+        return cursor
+
+    def discard(self, conn, sql, dictionary=False):
+        """Drop a statement whose cursor failed so the next use re-prepares it."""
+        with self._lock:
+            cursor = self._by_conn.get(conn, {}).pop((sql, dictionary), None)
+        if cursor is not None:
+            self._close_quietly(cursor)
+
+    def forget(self, conn):
+        """Close every cached statement of a connection that is being closed."""
+        with self._lock:
+            statements = self._by_conn.pop(conn, None)
+        for cursor in (statements or {}).values():
+            self._close_quietly(cursor)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "connections": len(self._by_conn),
+                "statements": sum(len(s) for s in self._by_conn.values()),
+                "max_statements": self.max_statements,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                **self._stats,
+            }
+
+    @staticmethod
+    def _close_quietly(cursor):
+        try:
+            cursor.close()
+        except Exception:
+            pass
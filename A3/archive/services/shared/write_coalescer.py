@@ -0,0 +1,112 @@
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+DB_COALESCE_WRITES = os.getenv("DB_COALESCE_WRITES", "false").lower() in ("1", "true", "yes")
+DB_COALESCE_WINDOW_MS = float(os.getenv("DB_COALESCE_WINDOW_MS", "2"))     # How long the first write of a batch waits for company
+DB_COALESCE_MAX_BATCH = int(os.getenv("DB_COALESCE_MAX_BATCH", "64"))      # Writes per transaction; a full batch is flushed at once
+
+SAVEPOINT = "coalesced_write"
+
+
+class WriteCoalescer:
+    """
+    Group commit for small writes. Writes submitted within window seconds of
+    each other (up to max_batch) run on one connection in one transaction
+    and share a single commit, so a burst of N writes costs one log flush
+    instead of N.
+
+    Each write is an operation(session) coroutine that must not commit. It
+    runs behind its own savepoint: if it raises, only its changes are rolled
+    back and only its caller gets the error. If the commit itself fails,
+    every caller in the batch gets that error.
+    """
+
+    def __init__(self, engine, window=DB_COALESCE_WINDOW_MS / 1000, max_batch=DB_COALESCE_MAX_BATCH):
+        self._engine = engine
+        self.window = window
+        self.max_batch = max(max_batch, 1)
+        self._pending = []  # (operation, future)
+        self._timer = None
+        self._flushes = set()
+        self._stats = {"batches": 0, "writes": 0, "failed_writes": 0, "failed_batches": 0}
+
+    async def submit(self, operation):
+        """Queue operation for the next batch and return its result once committed."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush_pending)
+        return await future
+
+    async def close(self):
+        """Flush queued writes and wait for running batches to finish."""
+        self._flush_pending()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        outcomes = []
+        try:
+            async with self._engine.session() as session:
+                for operation, future in batch:
+                    if future.cancelled():
+                        continue  # Caller went away before its write started
+                    await session.savepoint(SAVEPOINT)
+                    try:
+                        outcomes.append((future, None, await operation(session)))
+                    except Exception as e:
+                        await session.rollback_to_savepoint(SAVEPOINT)
+                        outcomes.append((future, e, None))
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Coalesced write batch of {len(batch)} failed: {str(e)}")
+            self._stats["failed_batches"] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._stats["batches"] += 1
+        for future, error, result in outcomes:
+            self._stats["writes"] += 1
+            if future.done():
+                continue
+            if error is not None:
+                self._stats["failed_writes"] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        batches = self._stats["batches"]
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "pending": len(self._pending),
+            "avg_batch_size": round(self._stats["writes"] / batches, 2) if batches else 0.0,
+            **self._stats,
+        }
+
+
+def create_write_coalescer(engine):
+    """A WriteCoalescer for engine when DB_COALESCE_WRITES is set, else None."""
+    if not DB_COALESCE_WRITES:
+        return None
+    logger.info(f"Coalescing writes: window {DB_COALESCE_WINDOW_MS}ms, up to {DB_COALESCE_MAX_BATCH} per commit")
+    return WriteCoalescer(engine)
@@ -0,0 +1,71 @@
+"""
+Compare the threaded and async database engines on the lookups behind
+GET /books/{ISBN} and GET /customers/{id}.
+
+Runs the same BookRepository/CustomerRepository calls the handlers make,
+with N concurrent callers on one event loop (i.e. one uvicorn worker).
+Point DB_HOST/DB_USER/DB_PASSWORD/DB_NAME at a database that contains the
+given ISBN and customer id:
+
+    python benchmarks/bench_db_engines.py --isbn 978-0321815736 --customer-id 1 \\
+        --requests 20000 --concurrency 50 200 1000
+"""
+import time
+import asyncio
+import argparse
+
+from common import db_config, connect, summarize
+from services.shared.db_engine import ThreadedEngine, AsyncEngine
+from services.shared.repositories import BookRepository, CustomerRepository
+
+
+async def run_workload(call, requests, concurrency):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+async def bench_engine(engine, args):
+    await engine.open()
+    try:
+        books = BookRepository(engine)
+        customers = CustomerRepository(engine)
+        workloads = [
+            ("GET /books/{ISBN}", lambda: books.get(args.isbn)),
+            ("GET /customers/{id}", lambda: customers.get_by_id(args.customer_id)),
+        ]
+        for label, call in workloads:
+            await call()  # Warm up the pool
+            for concurrency in args.concurrency:
+                latencies, elapsed = await run_workload(call, args.requests, concurrency)
+                summarize(f"{engine.name} {label} c={concurrency}", latencies, elapsed)
+        print(f"{engine.name} stats: {engine.stats()}")
+    finally:
+        await engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--isbn", required=True)
+    parser.add_argument("--customer-id", type=int, required=True)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--engines", nargs="+", default=["threaded", "async"], choices=["threaded", "async"])
+    args = parser.parse_args()
+
+    for name in args.engines:
+        engine = ThreadedEngine(connect) if name == "threaded" else AsyncEngine(db_config)
+        asyncio.run(bench_engine(engine, args))
+
+
+if __name__ == "__main__":
+    main()
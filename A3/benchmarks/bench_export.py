@@ -0,0 +1,101 @@
+"""
+Measure the GET /books/export pipeline (server-side cursor -> NDJSON/CSV
+chunks) on a large synthetic catalog: rows/s, MB/s and peak RSS.
+
+Seed a scratch database created from init_db.sql with synthetic books
+once, then run each mode in its own process so the peak RSS figures do
+not mix:
+
+    DB_NAME=BookstoreBench python benchmarks/bench_export.py --seed 1000000
+    DB_NAME=BookstoreBench python benchmarks/bench_export.py --mode stream --format ndjson
+    DB_NAME=BookstoreBench python benchmarks/bench_export.py --mode stream --format csv
+    DB_NAME=BookstoreBench python benchmarks/bench_export.py --mode buffered --format ndjson
+
+"buffered" is the baseline: one fetchall() of the whole table before
+encoding, as a plain SELECT through the repository would do.
+"""
+import time
+import asyncio
+import argparse
+import resource
+
+from common import db_config, connect
+from services.shared.db_engine import ThreadedEngine, AsyncEngine
+from services.shared.repositories import BookRepository, INSERT_BOOK
+from services.shared.export import encode_export
+
+SEED_CHUNK = 10000
+
+
+def seed(rows):
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM Books WHERE ISBN LIKE 'bench-%'")
+    existing = cursor.fetchone()[0]
+    start = time.perf_counter()
+    for offset in range(existing, rows, SEED_CHUNK):
+        cursor.executemany(INSERT_BOOK, [
+            (f"bench-{i:010d}", f"Synthetic Book {i}", f"Author {i % 5000}",
+             "A synthetic book used to benchmark catalog exports. " * 4,
+             ("fiction", "non-fiction", "poetry", "history")[i % 4], 10 + i % 9000 / 100, i % 500)
+            for i in range(offset, min(offset + SEED_CHUNK, rows))
+        ])
+        conn.commit()
+    conn.close()
+    print(f"Seeded {max(rows - existing, 0)} rows in {time.perf_counter() - start:.1f}s "
+          f"({max(rows, existing)} synthetic rows in total)")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def buffered_batches(engine):
+    async with engine.session(readonly=True) as session:
+        yield await session.fetchall("SELECT * FROM Books ORDER BY ISBN")
+
+
+async def run_export(engine, args):
+    await engine.open()
+    try:
+        if args.mode == "stream":
+            batches = BookRepository(engine).export(args.batch_size)
+        else:
+            batches = buffered_batches(engine)
+        rss_before = peak_rss_mb()
+        rows = size = 0
+        start = time.perf_counter()
+        async for chunk in encode_export(batches, args.format):
+            size += len(chunk)
+            rows += chunk.count(b"\n")
+        elapsed = time.perf_counter() - start
+    finally:
+        await engine.close()
+
+    if args.format == "csv":
+        rows -= 1  # Header line
+    print(f"{engine.name} {args.mode} {args.format}: {rows} rows, {size / 2 ** 20:.1f} MB in {elapsed:.2f}s  "
+          f"{rows / elapsed:,.0f} rows/s  {size / 2 ** 20 / elapsed:.1f} MB/s  "
+          f"peak RSS {peak_rss_mb():.1f} MB (+{peak_rss_mb() - rss_before:.1f} MB during export)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, metavar="ROWS", help="Insert synthetic books up to ROWS and exit")
+    parser.add_argument("--mode", default="stream", choices=["stream", "buffered"])
+    parser.add_argument("--format", default="ndjson", choices=["ndjson", "csv"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--engine", default="threaded", choices=["threaded", "async"])
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed)
+        return
+
+    engine = ThreadedEngine(connect) if args.engine == "threaded" else AsyncEngine(db_config)
+    asyncio.run(run_export(engine, args))
+
+
+if __name__ == "__main__":
+    main()
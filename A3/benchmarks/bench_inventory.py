@@ -0,0 +1,105 @@
+"""
+Hammer one hot ISBN with concurrent reservations (POST /books/{ISBN}/reserve)
+and check that stock is never oversold or lost.
+
+Stocks the book with --stock copies, then fires --requests single-copy
+reservations from --concurrency callers. With the conditional UPDATE
+exactly min(requests, stock) reservations must succeed and the final
+quantity must equal stock minus successes. --mode naive runs the old
+read-modify-write (SELECT quantity, then UPDATE ... SET quantity = ?)
+for comparison, which loses updates under contention:
+
+    python benchmarks/bench_inventory.py --isbn 978-0321815736 --stock 20000 \\
+        --requests 20000 --concurrency 50 200
+    python benchmarks/bench_inventory.py --isbn 978-0321815736 --mode naive
+"""
+import time
+import asyncio
+import argparse
+
+from common import db_config, connect, summarize
+from services.shared.db_engine import ThreadedEngine, AsyncEngine
+from services.shared.repositories import BookRepository
+
+
+async def naive_reserve(engine, isbn, quantity):
+    async with engine.session() as session:
+        row = await session.fetchone("SELECT quantity FROM Books WHERE ISBN = %s", (isbn,))
+        if row is None or row["quantity"] < quantity:
+            return False, row and row["quantity"]
+        await session.execute("UPDATE Books SET quantity = %s WHERE ISBN = %s", (row["quantity"] - quantity, isbn))
+        await session.commit()
+    return True, row["quantity"] - quantity
+
+
+async def set_stock(engine, isbn, stock):
+    async with engine.session() as session:
+        result = await session.execute("UPDATE Books SET quantity = %s WHERE ISBN = %s", (stock, isbn))
+        await session.commit()
+    if result.rowcount == 0:
+        raise SystemExit(f"No book with ISBN {isbn}")
+
+
+async def get_stock(engine, isbn):
+    async with engine.session() as session:
+        return (await session.fetchone("SELECT quantity FROM Books WHERE ISBN = %s", (isbn,)))["quantity"]
+
+
+async def run_workload(reserve, requests, concurrency):
+    latencies = []
+    outcomes = {"reserved": 0, "sold_out": 0}
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            reserved, _ = await reserve()
+            latencies.append(time.perf_counter() - start)
+            outcomes["reserved" if reserved else "sold_out"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, outcomes
+
+
+async def bench(engine, args):
+    await engine.open()
+    try:
+        books = BookRepository(engine)
+        if args.mode == "conditional":
+            reserve = lambda: books.reserve(args.isbn, 1)
+        else:
+            reserve = lambda: naive_reserve(engine, args.isbn, 1)
+
+        for concurrency in args.concurrency:
+            await set_stock(engine, args.isbn, args.stock)
+            latencies, elapsed, outcomes = await run_workload(reserve, args.requests, concurrency)
+            summarize(f"{engine.name} {args.mode} reserve c={concurrency}", latencies, elapsed)
+
+            final = await get_stock(engine, args.isbn)
+            expected_reserved = min(args.requests, args.stock)
+            lost = args.stock - outcomes["reserved"] - final
+            ok = outcomes["reserved"] == expected_reserved and lost == 0 and final >= 0
+            print(f"  reserved={outcomes['reserved']} (expected {expected_reserved}) sold_out={outcomes['sold_out']} "
+                  f"final stock={final} lost updates={abs(lost)} -> {'OK' if ok else 'INCONSISTENT'}")
+        await set_stock(engine, args.isbn, args.stock)
+    finally:
+        await engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--isbn", required=True)
+    parser.add_argument("--stock", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=12000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--mode", default="conditional", choices=["conditional", "naive"])
+    parser.add_argument("--engine", default="threaded", choices=["threaded", "async"])
+    args = parser.parse_args()
+
+    engine = ThreadedEngine(connect) if args.engine == "threaded" else AsyncEngine(db_config)
+    asyncio.run(bench(engine, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare the old JSON path with services.shared.fast_json.
+
+Responses: jsonable_encoder + JSONResponse (what FastAPI did for every
+handler) versus FastJSONResponse on the same content, and versus
+json_response() which skips jsonable_encoder. Requests: the BFFs'
+json.dumps(..., cls=CustomJSONEncoder) of a forwarded body versus
+fast_json.dumps, and response.json() versus fast_json.loads.
+
+    python benchmarks/bench_json.py --iterations 20000
+"""
+import json
+import time
+import argparse
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import common  # noqa: F401  (puts archive/ on sys.path)
+from services.shared.models import Book
+from services.shared.fast_json import FastJSONResponse, json_response, dumps, loads, orjson
+
+
+class CustomJSONEncoder(json.JSONEncoder):
+    """The encoder the BFFs used before fast_json."""
+
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return super().default(obj)
+
+
+BOOK = {"ISBN": "978-0321815736", "title": "Software Architecture in Practice", "Author": "Bass, L.",
+        "description": "seminal book on software architecture", "genre": "non-fiction",
+        "price": Decimal("59.95"), "quantity": 106}
+PAGE = {"books": [dict(BOOK, ISBN=f"978-{i:010d}") for i in range(100)], "nextCursor": "978-0000000099"}
+
+
+def time_per_call(call, iterations):
+    call()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def compare(label, variants, iterations):
+    baseline = None
+    for name, call in variants:
+        us = time_per_call(call, iterations)
+        baseline = baseline or us
+        print(f"{label:<22} {name:<36} {us:10.2f} us  x{baseline / us:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    n = args.iterations
+    print(f"orjson {'available' if orjson is not None else 'NOT installed, using the json fallback'}")
+
+    for label, content in (("one book", BOOK), ("page of 100 books", PAGE)):
+        compare(f"response {label}", [
+            ("jsonable_encoder + JSONResponse", lambda: JSONResponse(jsonable_encoder(content)).body),
+            ("jsonable_encoder + FastJSONResponse", lambda: FastJSONResponse(jsonable_encoder(content)).body),
+            ("json_response", lambda: json_response(content).body),
+        ], n)
+
+    book = Book(**BOOK)
+    body = dumps(BOOK)
+    compare("request body", [
+        ("dict + json.dumps(CustomJSONEncoder)", lambda: json.dumps(
+            {**book.dict(), "price": float(book.price)}, cls=CustomJSONEncoder).encode()),
+        ("fast_json.dumps(model)", lambda: dumps(book)),
+    ], n)
+    compare("parse response", [
+        ("json.loads", lambda: json.loads(body)),
+        ("fast_json.loads", lambda: loads(body)),
+    ], n)
+
+
+if __name__ == "__main__":
+    main()
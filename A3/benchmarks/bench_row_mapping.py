@@ -0,0 +1,120 @@
+"""
+Per-request cost of the GET /books/{ISBN} and GET /customers/{id} read path:
+dictionary cursor + SELECT * + FastAPI response handling (response_model
+validation for customers, jsonable_encoder, JSONResponse) versus tuple
+rows + RowMapper + json_response.
+
+The serialization half needs no database. Pass --isbn / --customer-id to
+also time the fetch itself (dictionary vs tuple cursor) against the
+database in DB_HOST/DB_NAME:
+
+    python benchmarks/bench_row_mapping.py --iterations 100000
+    python benchmarks/bench_row_mapping.py --isbn 978-0321815736 --customer-id 1
+"""
+import json
+import time
+import asyncio
+import argparse
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from common import connect
+from services.shared.models import CustomerResponse
+from services.shared.db_engine import ThreadedEngine
+from services.shared.repositories import BookRepository, CustomerRepository, BOOK_ROW, CUSTOMER_ROW
+from services.shared.fast_json import json_response
+
+BOOK_TUPLE = ("978-0321815736", "Software Architecture in Practice", "Bass, L.",
+              "seminal book on software architecture", "non-fiction", Decimal("59.95"), 106)
+CUSTOMER_TUPLE = (1, "starlord2002@gmail.com", "Star Lord", "+14122144122", "48 Galaxy Rd",
+                  "suite 4", "Fargo", "ND", "58102")
+
+CUSTOMER_FIELD = create_response_field(name="Response_get_customer", type_=CustomerResponse)
+
+
+async def old_book(row):
+    # No response_model on GET /books/{ISBN}: FastAPI only runs jsonable_encoder
+    content = await serialize_response(response_content=row)
+    return JSONResponse(content).body
+
+
+async def old_customer(row):
+    content = await serialize_response(field=CUSTOMER_FIELD, response_content=row)
+    return JSONResponse(content).body
+
+
+async def new_book(row):
+    return json_response(BOOK_ROW.to_dict(row)).body
+
+
+async def new_customer(row):
+    return json_response(CUSTOMER_ROW.to_dict(row)).body
+
+
+async def time_per_call(call, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await call()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def compare(label, old, new, iterations):
+    await old()
+    await new()
+    old_us = await time_per_call(old, iterations)
+    new_us = await time_per_call(new, iterations)
+    print(f"{label:<34} old {old_us:8.2f} us   new {new_us:8.2f} us   saved {old_us - new_us:8.2f} us "
+          f"({(1 - new_us / old_us) * 100:.0f}%)")
+
+
+async def bench_serialization(args):
+    book_dict = dict(zip(BOOK_ROW.columns, BOOK_TUPLE))
+    customer_dict = dict(zip(CUSTOMER_ROW.columns, CUSTOMER_TUPLE))
+    # Both paths must produce the same document
+    assert json.loads(await new_book(BOOK_TUPLE)) == json.loads(await old_book(book_dict))
+    assert json.loads(await new_customer(CUSTOMER_TUPLE)) == json.loads(await old_customer(customer_dict))
+    await compare("get_book serialization", lambda: old_book(book_dict), lambda: new_book(BOOK_TUPLE), args.iterations)
+    await compare("get_customer serialization", lambda: old_customer(customer_dict),
+                  lambda: new_customer(CUSTOMER_TUPLE), args.iterations)
+
+
+async def bench_fetch(args):
+    engine = ThreadedEngine(connect)
+    await engine.open()
+    try:
+        async def fetch_dict(sql, key):
+            async with engine.session(readonly=True) as session:
+                return await session.fetchone(sql, (key,))
+
+        books = BookRepository(engine)
+        customers = CustomerRepository(engine)
+        if args.isbn:
+            await compare("get_book fetch",
+                          lambda: fetch_dict("SELECT * FROM Books WHERE ISBN = %s", args.isbn),
+                          lambda: books.get(args.isbn), args.db_iterations)
+        if args.customer_id:
+            await compare("get_customer fetch",
+                          lambda: fetch_dict("SELECT * FROM Customers WHERE id = %s", args.customer_id),
+                          lambda: customers.get_by_id(args.customer_id), args.db_iterations)
+    finally:
+        await engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50000)
+    parser.add_argument("--isbn")
+    parser.add_argument("--customer-id", type=int)
+    parser.add_argument("--db-iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    asyncio.run(bench_serialization(args))
+    if args.isbn or args.customer_id:
+        asyncio.run(bench_fetch(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Measure GET /books/search query latency (BookRepository.search, i.e. the
+ft_books_search FULLTEXT index) and the size of that index.
+
+Seed a scratch database created from init_db.sql with synthetic books
+whose titles and descriptions are drawn from a small vocabulary, then
+run random one- to three-word queries against it:
+
+    DB_NAME=BookstoreBench python benchmarks/bench_search.py --seed 1000000
+    DB_NAME=BookstoreBench python benchmarks/bench_search.py --requests 5000 --concurrency 1 20
+
+Target: p99 under 20 ms per query at 1M titles.
+"""
+import time
+import random
+import asyncio
+import argparse
+
+from common import db_config, connect, summarize
+from services.shared.db_engine import ThreadedEngine, AsyncEngine
+from services.shared.repositories import BookRepository, INSERT_BOOK
+
+SEED_CHUNK = 10000
+TARGET_P99_MS = 20
+
+VOCABULARY = (
+    "software architecture design patterns distributed systems database cloud security network "
+    "algorithms compiler operating kernel memory storage python java rust golang functional "
+    "history empire revolution war ancient medieval modern science physics chemistry biology "
+    "galaxy space planet star ocean mountain river forest garden cooking travel music poetry "
+    "mystery detective murder romance dragon wizard kingdom journey secret shadow silence "
+    "economics finance market strategy leadership management startup marketing philosophy ethics"
+).split()
+
+
+def random_text(rng, words):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def seed(rows):
+    rng = random.Random(42)
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM Books WHERE ISBN LIKE 'srch-%'")
+    existing = cursor.fetchone()[0]
+    start = time.perf_counter()
+    for offset in range(existing, rows, SEED_CHUNK):
+        cursor.executemany(INSERT_BOOK, [
+            (f"srch-{i:010d}", random_text(rng, 4).title(), f"{rng.choice(VOCABULARY).title()}, {chr(65 + i % 26)}.",
+             random_text(rng, 40), rng.choice(("fiction", "non-fiction")), 10 + i % 9000 / 100, i % 500)
+            for i in range(offset, min(offset + SEED_CHUNK, rows))
+        ])
+        conn.commit()
+    conn.close()
+    print(f"Seeded {max(rows - existing, 0)} rows in {time.perf_counter() - start:.1f}s")
+
+
+def index_size():
+    """On-disk size of the FULLTEXT auxiliary tables and the configured FTS cache."""
+    conn = connect()
+    cursor = conn.cursor()
+    result = {}
+    try:
+        cursor.execute(
+            "SELECT COALESCE(SUM(ALLOCATED_SIZE), 0) FROM information_schema.INNODB_SYS_TABLESPACES "
+            "WHERE NAME LIKE %s",
+            (f"{db_config['database']}/fts\\_%",)
+        )
+        result["fts_tables_mb"] = round(int(cursor.fetchone()[0]) / 2 ** 20, 1)
+    except Exception as e:
+        result["fts_tables_mb"] = f"n/a ({e})"
+    cursor.execute("SELECT @@innodb_ft_cache_size, @@innodb_ft_total_cache_size")
+    cache_size, total_cache_size = cursor.fetchone()
+    result["ft_cache_mb"] = round(cache_size / 2 ** 20, 1)
+    result["ft_total_cache_mb"] = round(total_cache_size / 2 ** 20, 1)
+    conn.close()
+    return result
+
+
+async def run_workload(books, queries, requests, concurrency, limit):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for i in remaining:
+            start = time.perf_counter()
+            await books.search(queries[i % len(queries)], limit=limit)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+async def bench(engine, args):
+    rng = random.Random(7)
+    queries = [random_text(rng, rng.randint(1, 3)) for _ in range(1000)]
+    await engine.open()
+    try:
+        books = BookRepository(engine)
+        await books.search(queries[0])  # Warm up the pool and the index cache
+        for concurrency in args.concurrency:
+            latencies, elapsed = await run_workload(books, queries, args.requests, concurrency, args.limit)
+            summarize(f"{engine.name} search c={concurrency}", latencies, elapsed)
+            p99 = sorted(latencies)[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            print(f"  p99 {'within' if p99 < TARGET_P99_MS else 'OVER'} the {TARGET_P99_MS} ms target")
+    finally:
+        await engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, metavar="ROWS", help="Insert synthetic books up to ROWS and exit")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 20])
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--engine", default="threaded", choices=["threaded", "async"])
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed)
+        return
+
+    print(f"Index size: {index_size()}")
+    engine = ThreadedEngine(connect) if args.engine == "threaded" else AsyncEngine(db_config)
+    asyncio.run(bench(engine, args))
+
+
+if __name__ == "__main__":
+    main()
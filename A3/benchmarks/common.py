@@ -0,0 +1,39 @@
+"""Helpers shared by the benchmark scripts in this directory."""
+import os
+import sys
+import statistics
+
+# The services import the shared code as services.shared, which lives under archive/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "archive"))
+
+db_config = {
+    "host": os.getenv("DB_HOST", "127.0.0.1"),
+    "port": int(os.getenv("DB_PORT", "3306")),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", "password"),
+    "database": os.getenv("DB_NAME", "Bookstore"),
+    "connect_timeout": 10,
+}
+
+
+def connect():
+    import mariadb
+    conn = mariadb.connect(**db_config)
+    conn.autocommit = False
+    return conn
+
+
+def summarize(name, latencies, elapsed):
+    """Print throughput and latency percentiles (latencies in seconds)."""
+    latencies = sorted(latencies)
+    n = len(latencies)
+    if not n:
+        print(f"{name}: no samples")
+        return
+
+    def pct(p):
+        return latencies[min(n - 1, int(n * p))] * 1000
+
+    print(f"{name:<28} n={n:<7} {n / elapsed:>10.1f} ops/s  "
+          f"mean={statistics.mean(latencies) * 1000:.3f}ms  p50={pct(0.50):.3f}ms  "
+          f"p99={pct(0.99):.3f}ms  max={latencies[-1] * 1000:.3f}ms")
@@ -1,28 +1,29 @@
 from fastapi import FastAPI, HTTPException, Header, Response, Query, status, Request
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from typing import List, Optional, Union, Dict, Any
+import uuid
 import httpx
+import time
 import asyncio
-from services.shared.models import Book, CustomerBase, CustomerResponse, MobileCustomerResponse, RelatedBook
+from urllib.parse import urlencode, urlsplit
+from starlette.background import BackgroundTask
+from services.shared.models import Book, BookLookup, StockChange, CustomerBase, CustomerLookup, CustomerResponse, MobileCustomerResponse, RelatedBook
 from services.shared.auth import validate_client_type, validate_auth
+from services.shared.fast_json import FastJSONResponse, dumps, loads
+from services.shared.etag import not_modified, etag_matches
+from services.shared.cache import TTLCache
+from services.shared.cache_client import close_cache_client
+from services.shared.db_router import DB_WRITE_COOKIE, track_client_writes, mark_client_write, client_wrote_recently, client_write_cookie
 import os
 import logging
-import json
 from decimal import Decimal
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Custom JSON encoder to handle Decimal and other non-serializable types
-class CustomJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super().default(obj)
-
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # Service URLs
 BOOKS_SERVICE_URL = os.getenv("BOOKS_SERVICE_URL")
@@ -33,6 +34,24 @@ REQUEST_TIMEOUT = 30.0  # Overall request timeout in seconds
 CONNECT_TIMEOUT = 10.0  # Connection timeout in seconds
 MAX_RETRIES = 3
 RETRY_DELAY = 1.0
+BATCH_REQUEST_TIMEOUT = 600.0  # Bulk imports can take minutes
+EXPORT_READ_TIMEOUT = 60.0  # Longest gap between chunks of a catalog export
+
+# Appended to the backend's ETag for mobile clients, whose representation differs
+MOBILE_ETAG_SUFFIX = "-mobile"
+
+# Cache of formatted GET responses (see forward_cached_get); RESPONSE_CACHE_SIZE=0 disables it.
+# An entry is served without asking the backend for RESPONSE_CACHE_TTL seconds, the
+# longest a write made through another pod can go unseen; after that it is
+# revalidated with its ETag and kept for up to RESPONSE_CACHE_KEEP seconds
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "1"))
+RESPONSE_CACHE_KEEP = float(os.getenv("RESPONSE_CACHE_KEEP", "300"))
+response_cache = TTLCache("responses", RESPONSE_CACHE_SIZE, max(RESPONSE_CACHE_KEEP, RESPONSE_CACHE_TTL))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_cache_client()
 
 # Special route for health checks that bypasses middleware and validation
 @app.get("/status", include_in_schema=False)
@@ -43,6 +62,9 @@ def health_check():
     """
     return PlainTextResponse(content="OK", status_code=200)
 
+# Relay the services' read-your-writes cookie between the client and the backends
+app.middleware("http")(track_client_writes)
+
 # Block any non-status routes that don't have proper headers
 @app.middleware("http")
 async def validate_headers_middleware(request: Request, call_next):
@@ -121,26 +143,74 @@ async def http_exception_handler(request, exc):
         content={"message": exc.detail}
     )
 
-async def forward_request(method: str, url: str, headers: dict, **kwargs):
+def format_book_for_client(book: dict, x_client_type: str) -> dict:
+    # Format response for mobile clients (case-insensitive check)
+    if x_client_type.lower() in ["ios", "android"] and book.get("genre") == "non-fiction":
+        # Convert to integer 3 instead of string "3"
+        book["genre"] = 3
+    return book
+
+def format_customer_for_client(customer: dict, x_client_type: str) -> dict:
+    # Format response for mobile clients (ensure case-insensitive comparison);
+    # "Customer not found" markers from multi-get are passed through
+    if x_client_type.lower() in ["ios", "android"] and "message" not in customer:
+        logger.info(f"Formatting response for mobile client: {x_client_type}")
+        # Create a new dictionary with only the fields needed for mobile
+        return {
+            "id": customer["id"],
+            "userId": customer["userId"],
+            "name": customer["name"],
+            "phone": customer["phone"]
+        }
+    return customer
+
+def client_etag(etag: Optional[str], x_client_type: str) -> Optional[str]:
+    # Web clients get the backend's representation unchanged, mobile clients a reformatted one
+    if etag is None or x_client_type.lower() not in ["ios", "android"]:
+        return etag
+    return etag[:-1] + MOBILE_ETAG_SUFFIX + '"'
+
+def backend_if_none_match(if_none_match: Optional[str], x_client_type: str) -> Optional[str]:
+    # Map the client's ETags back to the backend's; tags of the other representation can never match
+    if not if_none_match or if_none_match.strip() == "*":
+        return if_none_match
+    mobile = x_client_type.lower() in ["ios", "android"]
+    suffix = MOBILE_ETAG_SUFFIX + '"'
+    tags = []
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.endswith(suffix) == mobile:
+            tags.append(tag[:-len(suffix)] + '"' if mobile else tag)
+    return ", ".join(tags) or None
+
+async def forward_request(method: str, url: str, headers: dict, return_etag: bool = False,
+                          attempts: int = MAX_RETRIES, **kwargs):
     """
-    Forward request to backend service with retries and better error handling
+    Forward request to backend service with retries and better error handling.
+    With return_etag the backend's ETag is returned as a third value; a 304
+    comes back as (304, None, etag). attempts=1 sends the request only once.
     """
     retry_count = 0
     last_error = None
     logger.info(f" url: {url}")
     logger.info(f"headers: {headers}")
-    logger.info(f"kwargs: {kwargs}")
-    while retry_count < MAX_RETRIES:
+    # Raw bodies (e.g. bulk imports) can be megabytes, don't log them
+    logger.info(f"kwargs: { {k: v for k, v in kwargs.items() if k != 'content'} }")
+    # A client that just wrote reads from the primary database (see track_client_writes)
+    write_cookie = client_write_cookie()
+    if write_cookie:
+        headers = {**(headers or {}), "Cookie": write_cookie}
+    while retry_count < attempts:
         try:
             # Configure timeouts
             timeout = httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
             
             # Log request attempt
-            logger.info(f"Forwarding {method} request to {url} (Attempt {retry_count + 1}/{MAX_RETRIES})")
+            logger.info(f"Forwarding {method} request to {url} (Attempt {retry_count + 1}/{attempts})")
             
-            # For POST and PUT requests, handle JSON serialization for Decimal objects
+            # For POST and PUT requests, serialize the body (Decimal, pydantic models) with dumps
             if method in ["POST", "PUT"] and "json" in kwargs:
-                kwargs["content"] = json.dumps(kwargs.pop("json"), cls=CustomJSONEncoder)
+                kwargs["content"] = dumps(kwargs.pop("json"))
                 headers = headers.copy() if headers else {}
                 headers["Content-Type"] = "application/json"
             
@@ -149,16 +219,25 @@ async def forward_request(method: str, url: str, headers: dict, **kwargs):
                 
                 # Log response
                 logger.info(f"Received {response.status_code} response from {url}")
+                if DB_WRITE_COOKIE in response.cookies:
+                    mark_client_write()
+
+                def result(status_code, data):
+                    return (status_code, data, response.headers.get("etag")) if return_etag else (status_code, data)
+
+                # Conditional GET: the client's copy is still current
+                if response.status_code == 304:
+                    return result(304, None)
                 
                 # Handle 204 No Content responses
                 if response.status_code == 204:
                     logger.info("Received 204 No Content response")
-                    return 204, []
+                    return result(204, [])
                 
                 # Handle 4xx error status codes - pass them through directly
                 if 400 <= response.status_code < 500:
                     try:
-                        error_detail = response.json().get('message', str(response.content))
+                        error_detail = loads(response.content).get('message', str(response.content))
                     except Exception:
                         error_detail = str(response.content)
                     
@@ -174,7 +253,7 @@ async def forward_request(method: str, url: str, headers: dict, **kwargs):
                 if response.status_code >= 500:
                     logger.warning(f"Error response from backend: {response.status_code}")
                     try:
-                        error_detail = response.json().get('message', str(response.content))
+                        error_detail = loads(response.content).get('message', str(response.content))
                     except Exception:
                         error_detail = str(response.content)
                         
@@ -185,15 +264,15 @@ async def forward_request(method: str, url: str, headers: dict, **kwargs):
                 
                 # Parse response for successful requests
                 try:
-                    json_response = response.json()
-                    return response.status_code, json_response
+                    json_response = loads(response.content)
+                    return result(response.status_code, json_response)
                 except Exception as e:
                     logger.error(f"Failed to parse JSON response: {str(e)}")
                     # logger.error(f"Response content: {response.text}")  
                     # Handle 204 responses that weren't caught earlier (belt and suspenders approach)
                     if response.status_code == 204 or not response.text:
                         logger.info("Empty response detected, returning empty list")
-                        return 204, []
+                        return result(204, [])
                     raise HTTPException(
                         status_code=status.HTTP_502_BAD_GATEWAY,
                         detail="Invalid response from backend service"
@@ -219,7 +298,7 @@ async def forward_request(method: str, url: str, headers: dict, **kwargs):
         retry_count += 1
         
         # Wait before retrying
-        if retry_count < MAX_RETRIES:
+        if retry_count < attempts:
             logger.info(f"Retrying in {RETRY_DELAY} seconds...")
             await asyncio.sleep(RETRY_DELAY)
     
@@ -240,35 +319,106 @@ async def forward_request(method: str, url: str, headers: dict, **kwargs):
             detail=f"Error communicating with backend service: {str(last_error)}"
         )
 
+async def forward_conditional_get(url: str, authorization: str, x_client_type: str,
+                                  if_none_match: Optional[str], **kwargs):
+    """
+    GET that forwards If-None-Match and returns (status, data, etag) with the
+    ETag of this client type's representation; a 304 has no data.
+    """
+    headers = {"Authorization": authorization}
+    backend_tags = backend_if_none_match(if_none_match, x_client_type)
+    if backend_tags:
+        headers["If-None-Match"] = backend_tags
+    status_code, data, etag = await forward_request("GET", url, headers=headers, return_etag=True, **kwargs)
+    return status_code, data, client_etag(etag, x_client_type)
+
+def client_group(x_client_type: str) -> str:
+    # iOS and Android get the same representation
+    return "mobile" if x_client_type.lower() in ["ios", "android"] else "web"
+
+def response_cache_key(url: str, params: Optional[dict], group: str) -> str:
+    # ISBN and userId lookups are case-insensitive in the backends, so keys are too
+    query = urlencode(sorted(params.items())) if params else ""
+    return f"GET {urlsplit(url).path}?{query} {group}".lower()
+
+async def invalidate_cached_responses(url: str, params: Optional[dict] = None):
+    # Only reaches this pod's cache daemon; other pods notice within RESPONSE_CACHE_TTL
+    await response_cache.invalidate_after_write(*(response_cache_key(url, params, group) for group in ("web", "mobile")))
+
+async def forward_cached_get(url: str, authorization: str, x_client_type: str, if_none_match: Optional[str],
+                             format_for_client, params: Optional[dict] = None):
+    """
+    GET through the response cache. Returns (status, data, etag) for this
+    client type's representation, data already run through
+    format_for_client; a 304 has no data. Entries are keyed by path, query
+    and client group and answer If-None-Match without a backend call.
+    Errors are not cached.
+
+    Invalidation only reaches this pod, while writes can go through any BFF
+    pod or deployment, so an entry is trusted for RESPONSE_CACHE_TTL seconds
+    only. An older one is revalidated with the backend's ETag: a 304 keeps
+    the formatted data, anything else replaces it. A change made elsewhere
+    is therefore served at most RESPONSE_CACHE_TTL seconds late.
+    """
+    # A client that just wrote must not get a response cached before its write
+    if not response_cache.enabled or client_wrote_recently():
+        status_code, data, etag = await forward_conditional_get(url, authorization, x_client_type, if_none_match,
+                                                                params=params)
+        if status_code == 200:
+            data = format_for_client(data, x_client_type)
+        return status_code, data, etag
+
+    async def load(backend_etag=None):
+        # An entry must hold the whole document, so only a revalidation is conditional
+        headers = {"Authorization": authorization}
+        if backend_etag:
+            headers["If-None-Match"] = backend_etag
+        status_code, data, etag = await forward_request("GET", url, headers=headers, return_etag=True, params=params)
+        if status_code == 304:
+            return None
+        if status_code == 200:
+            data = format_for_client(data, x_client_type)
+        return {"status": status_code, "data": data, "etag": client_etag(etag, x_client_type),
+                "backend_etag": etag, "checked": time.time()}
+
+    key = response_cache_key(url, params, client_group(x_client_type))
+    entry = await response_cache.get_or_load(key, load)
+    if time.time() - entry["checked"] >= RESPONSE_CACHE_TTL:
+        try:
+            fresh = await load(entry["backend_etag"])
+        except HTTPException:
+            await response_cache.invalidate_after_write(key)
+            raise
+        entry = fresh or {**entry, "checked": time.time()}
+        await response_cache.set(key, entry)
+    if etag_matches(if_none_match, entry["etag"]):
+        return 304, None, entry["etag"]
+    return entry["status"], entry["data"], entry["etag"]
+
 @app.post("/books", status_code=status.HTTP_201_CREATED)
 async def add_book(
     book: Book,
     response: Response,
     x_client_type: str = Header(...),
-    authorization: str = Header(...)
+    authorization: str = Header(...),
+    idempotency_key: Optional[str] = Header(None)
 ):
     # Validate headers
     await validate_client_type(x_client_type)
     await validate_auth(authorization)
 
-    # Convert Decimal values to float for serialization
-    book_dict = {
-        "ISBN": book.ISBN,
-        "title": book.title,
-        "Author": book.Author,
-        "description": book.description,
-        "genre": book.genre,
-        "price": float(book.price),
-        "quantity": book.quantity
-    }
-
-    # Forward request to books service
-    status_code, data = await forward_request(
-        "POST",
-        f"{BOOKS_SERVICE_URL}/books",
-        headers={"Authorization": authorization},
-        json=book_dict
-    )
+    # Forward request to books service; the Idempotency-Key (a new one if the
+    # client sent none) keeps forward_request's retries from creating it twice
+    try:
+        status_code, data = await forward_request(
+            "POST",
+            f"{BOOKS_SERVICE_URL}/books",
+            headers={"Authorization": authorization, "Idempotency-Key": idempotency_key or str(uuid.uuid4())},
+            json=book
+        )
+    finally:
+        # Even a failed forward may have reached the backend
+        await invalidate_cached_responses(f"{BOOKS_SERVICE_URL}/books/{book.ISBN}")
 
     # if status_code == 201:
     #     # Set Location header
@@ -280,6 +430,90 @@ async def add_book(
 
     return data
 
+@app.post("/books/batch", status_code=status.HTTP_200_OK)
+async def add_books_batch(
+    request: Request,
+    x_client_type: str = Header(...),
+    authorization: str = Header(...)
+):
+    # Validate headers
+    await validate_client_type(x_client_type)
+    await validate_auth(authorization)
+
+    # Pass the JSON array / NDJSON body through as-is; book-service validates each item.
+    # A batch has no Idempotency-Key and can run for minutes, so it is sent
+    # once and the whole exchange is bounded by BATCH_REQUEST_TIMEOUT
+    try:
+        status_code, data = await asyncio.wait_for(forward_request(
+            "POST",
+            f"{BOOKS_SERVICE_URL}/books/batch",
+            headers={
+                "Authorization": authorization,
+                "Content-Type": request.headers.get("content-type", "application/json")
+            },
+            attempts=1,
+            content=await request.body(),
+            timeout=httpx.Timeout(BATCH_REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+        ), BATCH_REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Books service did not finish the batch within {BATCH_REQUEST_TIMEOUT:.0f}s"
+        )
+
+    return data
+
+@app.get("/books/export")
+async def export_books(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    x_client_type: str = Header(...),
+    authorization: str = Header(...)
+):
+    # Validate headers
+    await validate_client_type(x_client_type)
+    await validate_auth(authorization)
+
+    # Relay the export chunk by chunk instead of going through forward_request,
+    # which would read the whole body into memory
+    client = httpx.AsyncClient(timeout=httpx.Timeout(EXPORT_READ_TIMEOUT, connect=CONNECT_TIMEOUT))
+    try:
+        request = client.build_request(
+            "GET",
+            f"{BOOKS_SERVICE_URL}/books/export",
+            headers={"Authorization": authorization},
+            params={"format": format}
+        )
+        upstream = await client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        await client.aclose()
+        logger.warning(f"Export request failed: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Books service unavailable"
+        )
+
+    if upstream.status_code >= 400:
+        await upstream.aread()
+        await upstream.aclose()
+        await client.aclose()
+        try:
+            error_detail = loads(upstream.content).get('message', str(upstream.content))
+        except Exception:
+            error_detail = str(upstream.content)
+        raise HTTPException(status_code=upstream.status_code, detail=error_detail)
+
+    async def close_upstream():
+        await upstream.aclose()
+        await client.aclose()
+
+    return StreamingResponse(
+        upstream.aiter_bytes(),
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get("content-type"),
+        headers={"Content-Disposition": upstream.headers.get("content-disposition", "attachment")},
+        background=BackgroundTask(close_upstream)
+    )
+
 @app.put("/books/{ISBN}", status_code=status.HTTP_200_OK)
 async def update_book(
     ISBN: str,
@@ -299,24 +533,16 @@ async def update_book(
             content={"message": "ISBN in URL does not match ISBN in request body"}
         )
 
-    # Convert Decimal values to float for serialization
-    book_dict = {
-        "ISBN": book.ISBN,
-        "title": book.title,
-        "Author": book.Author,
-        "description": book.description,
-        "genre": book.genre,
-        "price": float(book.price),
-        "quantity": book.quantity
-    }
-
     # Forward request to books service
-    status_code, data = await forward_request(
-        "PUT",
-        f"{BOOKS_SERVICE_URL}/books/{ISBN}",
-        headers={"Authorization": authorization},
-        json=book_dict
-    )
+    try:
+        status_code, data = await forward_request(
+            "PUT",
+            f"{BOOKS_SERVICE_URL}/books/{ISBN}",
+            headers={"Authorization": authorization},
+            json=book
+        )
+    finally:
+        await invalidate_cached_responses(f"{BOOKS_SERVICE_URL}/books/{ISBN}")
 
     # if status_code == 200:
     #     # Format response for mobile clients (case-insensitive check)
@@ -325,12 +551,37 @@ async def update_book(
 
     return data
 
+@app.get("/books/search")
+async def search_books(
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    limit: Optional[int] = Query(None, ge=1),
+    x_client_type: str = Header(...),
+    authorization: str = Header(...)
+):
+    # Validate headers
+    await validate_client_type(x_client_type)
+    await validate_auth(authorization)
+
+    # Forward request to books service
+    params = {"q": q, "cursor": cursor, "limit": limit}
+    status_code, data = await forward_request(
+        "GET",
+        f"{BOOKS_SERVICE_URL}/books/search",
+        headers={"Authorization": authorization},
+        params={key: str(value) for key, value in params.items() if value is not None}
+    )
+
+    data["books"] = [format_book_for_client(book, x_client_type) for book in data["books"]]
+    return data
+
 @app.get("/books/{ISBN}")
 @app.get("/books/isbn/{ISBN}")
 async def get_book(
     ISBN: str,
     x_client_type: str = Header(...),
-    authorization: str = Header(...)
+    authorization: str = Header(...),
+    if_none_match: Optional[str] = Header(None)
 ):
     logger.info(f"ISBN: {ISBN}")
     logger.info(f"x_client_type: {x_client_type}")
@@ -340,18 +591,114 @@ async def get_book(
     await validate_client_type(x_client_type)
     await validate_auth(authorization)
 
-    # Forward request to books service
+    # Forward request to books service unless the response is cached
+    status_code, data, etag = await forward_cached_get(
+        f"{BOOKS_SERVICE_URL}/books/{ISBN}", authorization, x_client_type, if_none_match, format_book_for_client
+    )
+
+    if status_code == 304:
+        return not_modified(etag)
+
+    return FastJSONResponse(content=data, headers={"ETag": etag} if etag else None)
+
+@app.get("/books")
+async def get_books(
+    isbn: Optional[str] = Query(None, description="Comma-separated list of ISBNs"),
+    genre: Optional[str] = Query(None),
+    Author: Optional[str] = Query(None),
+    minPrice: Optional[Decimal] = Query(None, ge=0),
+    maxPrice: Optional[Decimal] = Query(None, ge=0),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    limit: Optional[int] = Query(None, ge=1),
+    x_client_type: str = Header(...),
+    authorization: str = Header(...)
+):
+    # Validate headers
+    await validate_client_type(x_client_type)
+    await validate_auth(authorization)
+
+    # Forward request to books service: a multi-get when isbn is given, otherwise one catalog page
+    params = {
+        "isbn": isbn, "genre": genre, "Author": Author, "minPrice": minPrice,
+        "maxPrice": maxPrice, "cursor": cursor, "limit": limit
+    }
     status_code, data = await forward_request(
         "GET",
-        f"{BOOKS_SERVICE_URL}/books/{ISBN}",
-        headers={"Authorization": authorization}
+        f"{BOOKS_SERVICE_URL}/books",
+        headers={"Authorization": authorization},
+        params={key: str(value) for key, value in params.items() if value is not None}
     )
 
-    if status_code == 200:
-        # Format response for mobile clients (case-insensitive check)
-        if x_client_type.lower() in ["ios", "android"] and data["genre"] == "non-fiction":
-            # Convert to integer 3 instead of string "3"
-            data["genre"] = 3
+    if isbn is not None:
+        return [format_book_for_client(book, x_client_type) for book in data]
+    data["books"] = [format_book_for_client(book, x_client_type) for book in data["books"]]
+    return data
+
+@app.post("/books/lookup", status_code=status.HTTP_200_OK)
+async def lookup_books(
+    lookup: BookLookup,
+    x_client_type: str = Header(...),
+    authorization: str = Header(...)
+):
+    # Validate headers
+    await validate_client_type(x_client_type)
+    await validate_auth(authorization)
+
+    # Forward request to books service
+    status_code, data = await forward_request(
+        "POST",
+        f"{BOOKS_SERVICE_URL}/books/lookup",
+        headers={"Authorization": authorization},
+        json={"isbn": lookup.isbn}
+    )
+
+    return [format_book_for_client(book, x_client_type) for book in data]
+
+@app.post("/books/{ISBN}/reserve", status_code=status.HTTP_200_OK)
+async def reserve_book(
+    ISBN: str,
+    change: StockChange,
+    x_client_type: str = Header(...),
+    authorization: str = Header(...)
+):
+    # Validate headers
+    await validate_client_type(x_client_type)
+    await validate_auth(authorization)
+
+    # Forward request to books service; the stock change alters the cached book
+    try:
+        status_code, data = await forward_request(
+            "POST",
+            f"{BOOKS_SERVICE_URL}/books/{ISBN}/reserve",
+            headers={"Authorization": authorization},
+            json=change.dict()
+        )
+    finally:
+        await invalidate_cached_responses(f"{BOOKS_SERVICE_URL}/books/{ISBN}")
+
+    return data
+
+@app.post("/books/{ISBN}/release", status_code=status.HTTP_200_OK)
+async def release_book(
+    ISBN: str,
+    change: StockChange,
+    x_client_type: str = Header(...),
+    authorization: str = Header(...)
+):
+    # Validate headers
+    await validate_client_type(x_client_type)
+    await validate_auth(authorization)
+
+    # Forward request to books service; the stock change alters the cached book
+    try:
+        status_code, data = await forward_request(
+            "POST",
+            f"{BOOKS_SERVICE_URL}/books/{ISBN}/release",
+            headers={"Authorization": authorization},
+            json=change.dict()
+        )
+    finally:
+        await invalidate_cached_responses(f"{BOOKS_SERVICE_URL}/books/{ISBN}")
 
     return data
 
@@ -387,7 +734,8 @@ async def add_customer(
     customer: CustomerBase,
     response: Response,
     x_client_type: str = Header(...),
-    authorization: str = Header(...)
+    authorization: str = Header(...),
+    idempotency_key: Optional[str] = Header(None)
 ):
     # Validate headers
     await validate_client_type(x_client_type)
@@ -397,13 +745,16 @@ async def add_customer(
     logger.info(f"Adding customer: {customer.dict()}")
     logger.info(f"Client type: {x_client_type}")
 
-    # Forward request to customers service
-    status_code, data = await forward_request(
-        "POST",
-        f"{CUSTOMERS_SERVICE_URL}/customers",
-        headers={"Authorization": authorization},
-        json=customer.dict()
-    )
+    # Forward request to customers service with the same Idempotency-Key handling as add_book
+    try:
+        status_code, data = await forward_request(
+            "POST",
+            f"{CUSTOMERS_SERVICE_URL}/customers",
+            headers={"Authorization": authorization, "Idempotency-Key": idempotency_key or str(uuid.uuid4())},
+            json=customer.dict()
+        )
+    finally:
+        await invalidate_cached_responses(f"{CUSTOMERS_SERVICE_URL}/customers", {"userId": customer.userId})
 
     if status_code == 201:
         # Set Location header
@@ -426,11 +777,54 @@ async def add_customer(
         
     return data
 
+@app.get("/customers/lookup")
+async def get_customers(
+    id: Optional[str] = Query(None, description="Comma-separated list of customer IDs"),
+    userId: Optional[str] = Query(None, description="Comma-separated list of customer email addresses"),
+    x_client_type: str = Header(...),
+    authorization: str = Header(...)
+):
+    # Validate headers
+    await validate_client_type(x_client_type)
+    await validate_auth(authorization)
+
+    # Forward request to customers service, which resolves all customers in one query
+    params = {key: value for key, value in {"id": id, "userId": userId}.items() if value is not None}
+    status_code, data = await forward_request(
+        "GET",
+        f"{CUSTOMERS_SERVICE_URL}/customers/lookup",
+        headers={"Authorization": authorization},
+        params=params
+    )
+
+    return [format_customer_for_client(customer, x_client_type) for customer in data]
+
+@app.post("/customers/lookup", status_code=status.HTTP_200_OK)
+async def lookup_customers(
+    lookup: CustomerLookup,
+    x_client_type: str = Header(...),
+    authorization: str = Header(...)
+):
+    # Validate headers
+    await validate_client_type(x_client_type)
+    await validate_auth(authorization)
+
+    # Forward request to customers service
+    status_code, data = await forward_request(
+        "POST",
+        f"{CUSTOMERS_SERVICE_URL}/customers/lookup",
+        headers={"Authorization": authorization},
+        json=lookup.dict(exclude_none=True)
+    )
+
+    return [format_customer_for_client(customer, x_client_type) for customer in data]
+
 @app.get("/customers/{id}", response_model=None)
 async def get_customer(
     id: int,
     x_client_type: str = Header(...),
-    authorization: str = Header(...)
+    authorization: str = Header(...),
+    if_none_match: Optional[str] = Header(None)
 ):
     # Validate headers
     await validate_client_type(x_client_type)
@@ -440,35 +834,23 @@ async def get_customer(
     logger.info(f"Getting customer by id: {id}")
     logger.info(f"Client type: {x_client_type}")
 
-    # Forward request to customers service
-    status_code, data = await forward_request(
-        "GET",
-        f"{CUSTOMERS_SERVICE_URL}/customers/{id}",
-        headers={"Authorization": authorization}
+    # Forward request to customers service unless the response is cached
+    status_code, data, etag = await forward_cached_get(
+        f"{CUSTOMERS_SERVICE_URL}/customers/{id}", authorization, x_client_type, if_none_match,
+        format_customer_for_client
     )
 
-    if status_code == 200:
-        # Format response for mobile clients (ensure case-insensitive comparison)
-        if x_client_type.lower() in ["ios", "android"]:
-            logger.info(f"Formatting response for mobile client: {x_client_type}")
-            # Create a new dictionary with only the fields needed for mobile
-            mobile_data = {
-                "id": data["id"],
-                "userId": data["userId"],
-                "name": data["name"],
-                "phone": data["phone"]
-            }
-            # Log the mobile data being returned
-            logger.info(f"Returning mobile data: {mobile_data}")
-            return mobile_data
-        
-    return data
+    if status_code == 304:
+        return not_modified(etag)
+
+    return FastJSONResponse(content=data, headers={"ETag": etag} if etag else None)
 
 @app.get("/customers", response_model=None)
 async def get_customer_by_userId(
     userId: str = Query(..., description="Customer email address (userId)"),
     x_client_type: str = Header(...),
-    authorization: str = Header(...)
+    authorization: str = Header(...),
+    if_none_match: Optional[str] = Header(None)
 ):
     # Validate headers
     await validate_client_type(x_client_type)
@@ -478,27 +860,13 @@ async def get_customer_by_userId(
     logger.info(f"Getting customer by userId: {userId}")
     logger.info(f"Client type: {x_client_type}")
 
-    # Forward request to customers service
-    status_code, data = await forward_request(
-        "GET",
-        f"{CUSTOMERS_SERVICE_URL}/customers",
-        headers={"Authorization": authorization},
-        params={"userId": userId}
+    # Forward request to customers service unless the response is cached
+    status_code, data, etag = await forward_cached_get(
+        f"{CUSTOMERS_SERVICE_URL}/customers", authorization, x_client_type, if_none_match,
+        format_customer_for_client, params={"userId": userId}
     )
 
-    if status_code == 200:
-        # Format response for mobile clients (ensure case-insensitive comparison)
-        if x_client_type.lower() in ["ios", "android"]:
-            logger.info(f"Formatting response for mobile client: {x_client_type}")
-            # Create a new dictionary with only the fields needed for mobile
-            mobile_data = {
-                "id": data["id"],
-                "userId": data["userId"],
-                "name": data["name"],
-                "phone": data["phone"]
-            }
-            # Log the mobile data being returned
-            logger.info(f"Returning mobile data: {mobile_data}")
-            return mobile_data
-        
-    return data
\ No newline at end of file
+    if status_code == 304:
+        return not_modified(etag)
+
+    return FastJSONResponse(content=data, headers={"ETag": etag} if etag else None)
\ No newline at end of file
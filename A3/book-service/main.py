@@ -3,22 +3,32 @@ from typing import List, Optional  # Add List to your imports
 import httpx
 from fastapi import FastAPI, HTTPException, Header, Response, Query, status, Request
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, constr, condecimal, conint, EmailStr, validator, ValidationError
-from services.shared.models import RelatedBook
+from services.shared.models import RelatedBook, BookLookup, StockChange
 from services.shared.circuit_breaker import init_circuit_state, is_circuit_open, open_circuit, close_circuit, handle_result
+from services.shared.db_engine import create_engine
+from services.shared.db_router import track_client_writes
+from services.shared.db_health import DB_CONNECT_TIMEOUT, DB_QUERY_TIMEOUT
+from services.shared.repositories import BookRepository, CustomerRepository, IdempotencyRepository
+from services.shared.write_coalescer import create_write_coalescer
+from services.shared.idempotency import IdempotencyStore
+from services.shared.cache_client import close_cache_client
+from services.shared.cache import TTLCache, StaleWhileRevalidateCache, cache_daemon_stats
+from services.shared.etag import etag_response, document_etag
+from services.shared.fast_json import FastJSONResponse, json_response, loads
+from services.shared.export import encode_export, EXPORT_MEDIA_TYPES
 from typing import Optional
 import mariadb
+from mariadb.constants import CLIENT
 import os
-import time
 from decimal import Decimal
 import logging
 import jwt
 from datetime import datetime
-import json
 from jwt_validator import validate_jwt_token
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -32,6 +42,30 @@ CIRCUIT_BREAKER_THRESHOLD = 5  # Number of failures before opening circuit
 CIRCUIT_BREAKER_TIMEOUT = 60   # Seconds to keep circuit open
 CIRCUIT_BREAKER_FILE = "/mnt/circuit/circuit_state.json"
 REQUEST_TIMEOUT = 3.0  # Timeout for external service calls in seconds
+
+# Bulk import: books inserted per executemany transaction
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "1000"))
+# Multi-get: most ISBNs resolved by one request
+MAX_MULTI_GET = int(os.getenv("MAX_MULTI_GET", "100"))
+# Catalog listing: default and largest page size
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "100"))
+# Search: deepest result reachable by paging
+MAX_SEARCH_OFFSET = int(os.getenv("MAX_SEARCH_OFFSET", "1000"))
+# Read-through cache of GET /books/{ISBN}; BOOK_CACHE_SIZE=0 disables it
+BOOK_CACHE_SIZE = int(os.getenv("BOOK_CACHE_SIZE", "10000"))
+BOOK_CACHE_TTL = float(os.getenv("BOOK_CACHE_TTL", "60"))
+# Seconds an unknown ISBN is answered with 404 from the cache; POST /books clears it at once
+BOOK_NOT_FOUND_TTL = float(os.getenv("BOOK_NOT_FOUND_TTL", "5"))
+# Related books: recommender answers are served for RELATED_BOOKS_FRESH_TTL seconds, then
+# served while refreshed in the background for RELATED_BOOKS_REVALIDATE_TTL more, and kept
+# up to RELATED_BOOKS_MAX_STALE seconds for when the recommender fails
+RELATED_BOOKS_CACHE_SIZE = int(os.getenv("RELATED_BOOKS_CACHE_SIZE", "10000"))
+RELATED_BOOKS_FRESH_TTL = float(os.getenv("RELATED_BOOKS_FRESH_TTL", "300"))
+RELATED_BOOKS_REVALIDATE_TTL = float(os.getenv("RELATED_BOOKS_REVALIDATE_TTL", "3600"))
+RELATED_BOOKS_MAX_STALE = float(os.getenv("RELATED_BOOKS_MAX_STALE", "86400"))
+# Export: rows fetched from the server-side cursor per chunk
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
     
 
 # Determine if this is a BFF service based on port
@@ -66,6 +100,17 @@ async def validate_client_type(x_client_type: Optional[str] = Header(None)):
 async def startup_event():
     init_circuit_state()
     logger.info("✅ Circuit breaker state initialized.")
+    await db_engine.open()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if write_coalescer is not None:
+        await write_coalescer.close()
+    await close_cache_client()
+    await db_engine.close()
+
+# Reads by a client that just wrote go to the primary on every worker and pod
+app.middleware("http")(track_client_writes)
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
@@ -104,27 +149,46 @@ db_config = {
     "user": os.getenv("DB_USER", "Bookstore"),
     "password": os.getenv("DB_PASSWORD", "password"),
     "database": os.getenv("DB_NAME", "Bookstore"),
-    "connect_timeout": 300000,  # 5 minutes connection timeout
-    "read_timeout": 300000,     # 5 minutes read timeout
-    "write_timeout": 300000     # 5 minutes write timeout
+    "connect_timeout": DB_CONNECT_TIMEOUT,      # Seconds per connection attempt
+    "read_timeout": int(DB_QUERY_TIMEOUT),      # Hard cap on waiting for a query result
+    "write_timeout": int(DB_QUERY_TIMEOUT),
+    "client_flag": CLIENT.FOUND_ROWS            # UPDATE rowcount counts matched rows, not changed rows
 }
 
-def get_db_connection():
-    retries = 5
-    while retries > 0:
-        try:
-            connection = mariadb.connect(**db_config)
-            connection.autocommit = False
-            return connection
-        except mariadb.Error as e:
-            print(f"Database connection error: {str(e)}")
-            retries -= 1
-            if retries == 0:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Database connection failed: {str(e)}"
-                )
-            time.sleep(2)  # Increased sleep time between retries
+def get_db_connection(config=db_config):
+    # Single attempt; the engine retries with async backoff (see services.shared.db_health)
+    connection = mariadb.connect(**config)
+    connection.autocommit = False
+    return connection
+
+# Per-worker database engine selected by DB_ENGINE ("threaded" pool + executor, or "async"),
+# routing reads to DB_REPLICA_HOSTS when set
+db_engine = create_engine(get_db_connection, db_config)
+# Optional group commit for single-row writes (DB_COALESCE_WRITES)
+write_coalescer = create_write_coalescer(db_engine)
+book_repository = BookRepository(db_engine, write_coalescer)
+customer_repository = CustomerRepository(db_engine, write_coalescer)
+# Responses to POSTs sent with an Idempotency-Key header, kept in the database
+# so a retry that reaches another replica is still recognized
+idempotency_store = IdempotencyStore(backend=IdempotencyRepository(db_engine))
+# Books by ISBN; writes below invalidate their entries
+book_cache = TTLCache("books", BOOK_CACHE_SIZE, BOOK_CACHE_TTL, negative_ttl=BOOK_NOT_FOUND_TTL)
+
+def book_cache_key(isbn: str) -> str:
+    # ISBN comparisons in the database are case-insensitive
+    return isbn.upper()
+
+# Recommendations per ISBN, empty lists (the recommender's 204) included
+related_books_cache = StaleWhileRevalidateCache(
+    "related-books", RELATED_BOOKS_CACHE_SIZE, RELATED_BOOKS_FRESH_TTL,
+    RELATED_BOOKS_REVALIDATE_TTL, RELATED_BOOKS_MAX_STALE
+)
+
+async def load_book(isbn: str):
+    book = await book_repository.get(isbn)
+    if book is None:
+        return None
+    return {"etag": document_etag(book), "book": book}
 
 # Data Model for Validation
 class Book(BaseModel):
@@ -193,48 +257,261 @@ class CustomerResponse(CustomerBase):
 @app.post("/books", status_code=status.HTTP_201_CREATED)
 async def add_book(
     book: Book,
-    response: Response,
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
     # await validate_auth(authorization)
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # Check if ISBN already exists
-        cursor.execute("SELECT ISBN FROM Books WHERE ISBN = %s", (book.ISBN,))
-        existing_book = cursor.fetchone()
-        
-        if existing_book:
+    async def create():
+        try:
+            # Insert the new book; the primary key rejects an existing ISBN
+            if not await book_repository.insert(book):
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="This ISBN already exists in the system."
+                )
+            await book_cache.invalidate_after_write(book_cache_key(book.ISBN))
+
+            return json_response(
+                book,
+                status_code=status.HTTP_201_CREATED,
+                headers={"Location": f"/books/{book.ISBN}"}
+            )
+
+        except HTTPException as e:
+            raise e
+        except Exception as err:
             raise HTTPException(
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                detail="This ISBN already exists in the system."
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=str(err)
             )
 
-        # Insert the new book
-        cursor.execute(
-            "INSERT INTO Books (ISBN, title, Author, description, genre, price, quantity) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-            (book.ISBN, book.title, book.Author, book.description, book.genre, float(book.price), book.quantity)
+    # A retry with the same Idempotency-Key gets the stored response
+    return await idempotency_store.run("POST /books", idempotency_key, book, create)
+
+def format_validation_error(err: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in err.errors())
+
+async def iter_batch_items(request: Request):
+    """
+    Yield (item, error) for each book in a JSON array body, or for each line
+    of an NDJSON body (Content-Type application/x-ndjson), read as a stream.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" not in content_type:
+        try:
+            items = loads(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON body: {str(e)}")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a JSON array of books")
+        for item in items:
+            yield item, None
+        return
+
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_ndjson_line(line)
+    if buffer.strip():
+        yield parse_ndjson_line(buffer)
+
+def parse_ndjson_line(line: bytes):
+    try:
+        return loads(line), None
+    except ValueError as e:
+        return None, f"Invalid JSON: {str(e)}"
+
+# Bulk import endpoint
+@app.post("/books/batch", status_code=status.HTTP_200_OK)
+async def add_books_batch(
+    request: Request,
+    x_client_type: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    results = []
+    counts = {"created": 0, "duplicate": 0, "invalid": 0}
+    pending = []   # (index, Book) waiting for the next executemany chunk
+    seen = set()   # ISBNs already in this request
+
+    def record(index, isbn, outcome, error=None):
+        counts[outcome] += 1
+        result = {"index": index, "ISBN": isbn, "status": outcome}
+        if error:
+            result["error"] = error
+        results.append(result)
+
+    async def flush():
+        existing = await book_repository.insert_many([book for _, book in pending])
+        await book_cache.invalidate_after_write(*(book_cache_key(book.ISBN) for _, book in pending if book.ISBN not in existing))
+        for index, book in pending:
+            record(index, book.ISBN, "duplicate" if book.ISBN in existing else "created")
+        pending.clear()
+
+    try:
+        index = 0
+        async for item, error in iter_batch_items(request):
+            isbn = item.get("ISBN") if isinstance(item, dict) else None
+            if error is None:
+                try:
+                    if not isinstance(item, dict):
+                        raise TypeError("Expected a JSON object")
+                    book = Book(**item)
+                except ValidationError as e:
+                    error = format_validation_error(e)
+                except TypeError as e:
+                    error = str(e)
+
+            if error is not None:
+                record(index, isbn, "invalid", error)
+            elif book.ISBN in seen:
+                record(index, book.ISBN, "duplicate")
+            else:
+                seen.add(book.ISBN)
+                pending.append((index, book))
+                if len(pending) >= BATCH_CHUNK_SIZE:
+                    await flush()
+            index += 1
+
+        if pending:
+            await flush()
+
+        results.sort(key=lambda result: result["index"])
+        return {**counts, "results": results}
+
+    except HTTPException as e:
+        raise e
+    except Exception as err:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(err)
         )
-        conn.commit()
 
-        # Set Location header
-        response.headers["Location"] = f"/books/{book.ISBN}"
+def parse_isbn_list(isbns: List[str]) -> List[str]:
+    isbns = [isbn.strip() for isbn in isbns if isbn.strip()]
+    if not isbns:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one ISBN is required")
+    if len(isbns) > MAX_MULTI_GET:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_MULTI_GET} ISBNs can be requested at once"
+        )
+    return isbns
 
-        return {
-            "ISBN": book.ISBN,
-            "title": book.title,
-            "Author": book.Author,
-            "description": book.description,
-            "genre": book.genre,
-            "price": float(book.price),
-            "quantity": book.quantity
-        }
+async def lookup_books(isbns: List[str]):
+    """Resolve ISBNs with one query; results follow the request order."""
+    try:
+        found = await book_repository.get_many(isbns)
+        return json_response([
+            found.get(isbn.upper()) or {"ISBN": isbn, "message": "Book not found"}
+            for isbn in isbns
+        ])
+
+    except HTTPException as e:
+        raise e
+    except Exception as err:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(err)
+        )
+
+async def list_books(cursor, limit, genre, author, min_price, max_price):
+    """One page of the catalog; nextCursor is the ISBN to pass as cursor for the next page."""
+    if min_price is not None and max_price is not None and min_price > max_price:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="minPrice must not exceed maxPrice")
+
+    try:
+        # Fetch one extra row to learn whether another page follows
+        books = await book_repository.list(
+            after=cursor, limit=limit + 1, genre=genre, author=author,
+            min_price=min_price, max_price=max_price
+        )
+        next_cursor = books[limit - 1]["ISBN"] if len(books) > limit else None
+        return json_response({"books": books[:limit], "nextCursor": next_cursor})
+
+    except HTTPException as e:
+        raise e
+    except Exception as err:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(err)
+        )
+
+# Multi-get (isbn=...) or, without isbn, a keyset-paginated catalog listing
+@app.get("/books")
+async def get_books(
+    isbn: Optional[str] = Query(None, description="Comma-separated list of ISBNs"),
+    genre: Optional[str] = Query(None),
+    Author: Optional[str] = Query(None),
+    minPrice: Optional[Decimal] = Query(None, ge=0),
+    maxPrice: Optional[Decimal] = Query(None, ge=0),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    x_client_type: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    if isbn is not None:
+        return await lookup_books(parse_isbn_list(isbn.split(",")))
+    return await list_books(cursor, limit, genre, Author, minPrice, maxPrice)
+
+@app.get("/books/search")
+async def search_books(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to look for in title, Author and description"),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    x_client_type: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    """Relevance-ranked full-text search; nextCursor pages through the results."""
+    offset = 0
+    if cursor is not None:
+        if not cursor.isdigit():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        offset = int(cursor)
+    if offset > MAX_SEARCH_OFFSET:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Search results can be paged up to {MAX_SEARCH_OFFSET} books deep"
+        )
+
+    try:
+        # Fetch one extra row to learn whether another page follows
+        books = await book_repository.search(q, limit=limit + 1, offset=offset)
+        next_cursor = str(offset + limit) if len(books) > limit else None
+        return json_response({"books": books[:limit], "nextCursor": next_cursor})
+
+    except HTTPException as e:
+        raise e
+    except Exception as err:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(err)
+        )
 
+@app.get("/books/export")
+async def export_books(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    x_client_type: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Stream the whole catalog as NDJSON or CSV. Rows come from an unbuffered
+    cursor one EXPORT_BATCH_SIZE batch at a time, so memory stays flat
+    however large the table is.
+    """
+    chunks = encode_export(book_repository.export(EXPORT_BATCH_SIZE), format)
+
+    # Read the first chunk up front so database errors still get a proper status code
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
     except HTTPException as e:
         raise e
     except Exception as err:
@@ -242,11 +519,25 @@ async def add_book(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+
+    async def body():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="books.{format}"'}
+    )
+
+@app.post("/books/lookup", status_code=status.HTTP_200_OK)
+async def lookup_books_post(
+    lookup: BookLookup,
+    x_client_type: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    return await lookup_books(parse_isbn_list(lookup.isbn))
 
 @app.put("/books/{ISBN}", status_code=status.HTTP_200_OK)
 async def update_book(
@@ -267,31 +558,19 @@ async def update_book(
         )
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # Check if book exists
-        cursor.execute("SELECT * FROM Books WHERE ISBN = %s", (ISBN,))
-        existing_book = cursor.fetchone()
-
-        if not existing_book:
+        # A missing book shows up as an UPDATE that matched no rows
+        updated = await book_repository.update(book)
+        await book_cache.invalidate_after_write(book_cache_key(ISBN))
+        if not updated:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
 
-        cursor.execute(
-            """UPDATE Books 
-               SET title = %s, Author = %s, description = %s, genre = %s, price = %s, quantity = %s
-               WHERE ISBN = %s""",
-            (book.title, book.Author, book.description, book.genre, float(book.price), book.quantity, ISBN)
-        )
-        conn.commit()
-
         return {
             "ISBN": ISBN,
             "title": book.title,
             "Author": book.Author,
             "description": book.description,
             "genre": book.genre,
-            "price": float(book.price),
+            "price": book.price,
             "quantity": book.quantity
         }
 
@@ -302,40 +581,89 @@ async def update_book(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+
+@app.post("/books/{ISBN}/reserve", status_code=status.HTTP_200_OK)
+async def reserve_book(
+    ISBN: str,
+    change: StockChange,
+    x_client_type: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    try:
+        reserved, quantity = await book_repository.reserve(ISBN, change.quantity)
+        if reserved:
+            await book_cache.invalidate_after_write(book_cache_key(ISBN))
+
+        if quantity is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+        if not reserved:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Only {quantity} copies in stock"
+            )
+
+        return {"ISBN": ISBN, "quantity": quantity}
+
+    except HTTPException as e:
+        raise e
+    except Exception as err:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(err)
+        )
+
+@app.post("/books/{ISBN}/release", status_code=status.HTTP_200_OK)
+async def release_book(
+    ISBN: str,
+    change: StockChange,
+    x_client_type: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    try:
+        released, quantity = await book_repository.release(ISBN, change.quantity)
+        if released:
+            await book_cache.invalidate_after_write(book_cache_key(ISBN))
+
+        if not released:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+
+        return {"ISBN": ISBN, "quantity": quantity}
+
+    except HTTPException as e:
+        raise e
+    except Exception as err:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(err)
+        )
 
 @app.get("/books/{ISBN}")
 @app.get("/books/isbn/{ISBN}")
 async def get_book(
     ISBN: str,
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
     # await validate_auth(authorization)
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # Fetch book from database
-        cursor.execute("SELECT * FROM Books WHERE ISBN = %s", (ISBN,))
-        book = cursor.fetchone()
+        # Fetch book from the cache, or the database on a miss (/books/isbn/{ISBN} shares the entries)
+        cached = await book_cache.get_or_load(book_cache_key(ISBN), lambda: load_book(ISBN))
 
-        if not book:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+        if not cached:
+            # Built directly: unknown ISBNs are hammered, skip raising through the handlers
+            return json_response({"message": "Book not found"}, status_code=status.HTTP_404_NOT_FOUND)
 
         # Handle mobile app specific requirement for BFF service
         # if IS_BFF_SERVICE and x_client_type in ["iOS", "Android"]:
         #     if book["genre"] == "non-fiction":
         #         book["genre"] = "3"
 
-        return book
+        # The ETag is cached with the book, so a 304 needs no serialization
+        return etag_response(cached["book"], if_none_match, etag=cached["etag"])
 
     except HTTPException as e:
         raise e
@@ -344,11 +672,6 @@ async def get_book(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 
 # Related books endpoint
@@ -359,6 +682,17 @@ async def get_related_books(
     x_client_type: Optional[str] = Header(None),
     authorization: Optional[str] = Header(None)
 ):
+    # Cached answers are served without calling the recommender; a stale one
+    # also stands in when the circuit is open or the call fails
+    recommendations = await related_books_cache.get_or_load(
+        book_cache_key(ISBN), lambda: fetch_related_books(ISBN)
+    )
+    if not recommendations:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    return recommendations
+
+async def fetch_related_books(ISBN: str) -> list:
+    """Ask the recommender for ISBN's related books; an empty list stands for its 204."""
     # Check circuit breaker state
     # if not await circuit_breaker.check_state():
     #     raise HTTPException(
@@ -394,14 +728,11 @@ async def get_related_books(
                 handle_result(success=True)
                 
                 # Parse and return recommendations
-                recommendations = response.json()
-                if not recommendations:
-                    return Response(status_code=status.HTTP_204_NO_CONTENT)
-                return recommendations
+                return response.json() or []
             elif response.status_code == 204:
                 handle_result(success=True)
                 logger.info(f"204 NO CONTENT RESPONSE")
-                return Response(status_code=status.HTTP_204_NO_CONTENT)
+                return []
             else:
                 # Handle unexpected response
                 # await circuit_breaker.record_failure()
@@ -433,73 +764,56 @@ async def get_related_books(
 @app.post("/customers", response_model=CustomerResponse, status_code=status.HTTP_201_CREATED)
 async def add_customer(
     customer: CustomerBase,
-    response: Response,
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
     # await validate_auth(authorization)
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+    async def create():
+        try:
+            # Insert new customer; the unique userId constraint rejects duplicates
+            new_id = await customer_repository.insert(customer)
 
-        # Check if userId already exists
-        cursor.execute("SELECT id FROM Customers WHERE userId = %s", (customer.userId,))
-        existing_customer = cursor.fetchone()
+            if new_id is None:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="This user ID already exists in the system."
+                )
 
-        if existing_customer:
+            # Return the customer data directly
+            return json_response({
+                "id": new_id,
+                "userId": customer.userId,
+                "name": customer.name,
+                "phone": customer.phone,
+                "address": customer.address,
+                "address2": customer.address2,
+                "city": customer.city,
+                "state": customer.state,
+                "zipcode": customer.zipcode
+            }, status_code=status.HTTP_201_CREATED, headers={"Location": f"/customers/{new_id}"})
+
+        except HTTPException as e:
+            raise e
+        except Exception as err:
             raise HTTPException(
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                detail="This user ID already exists in the system."
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=str(err)
             )
 
-        # Insert new customer
-        cursor.execute(
-            """INSERT INTO Customers (userId, name, phone, address, address2, city, state, zipcode)
-               VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-            (customer.userId, customer.name, customer.phone, customer.address, 
-             customer.address2, customer.city, customer.state, customer.zipcode)
-        )
-        conn.commit()
-
-        new_id = cursor.lastrowid
-
-        # Set Location header
-        response.headers["Location"] = f"/customers/{new_id}"
-
-        # Return the customer data directly
-        return {
-            "id": new_id,
-            "userId": customer.userId,
-            "name": customer.name,
-            "phone": customer.phone,
-            "address": customer.address,
-            "address2": customer.address2,
-            "city": customer.city,
-            "state": customer.state,
-            "zipcode": customer.zipcode
-        }
-
-    except HTTPException as e:
-        raise e
-    except Exception as err:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=str(err)
-        )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+    # A retry with the same Idempotency-Key gets the stored response and
+    # does not insert or publish the customer event again
+    return await idempotency_store.run("POST /customers", idempotency_key, customer, create)
 
 @app.get("/customers/{id}", response_model=CustomerResponse)
 async def get_customer(
     id: int,
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
@@ -512,18 +826,14 @@ async def get_customer(
                 detail="Invalid customer ID"
             )
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
         # Fetch customer from database
-        cursor.execute("SELECT * FROM Customers WHERE id = %s", (id,))
-        customer = cursor.fetchone()
+        customer = await customer_repository.get_by_id(id)
 
         if not customer:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Customer not found")
 
-
-        return customer
+        # 304 when the client already holds this version
+        return etag_response(customer, if_none_match)
 
     except HTTPException as e:
         raise e
@@ -532,17 +842,13 @@ async def get_customer(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 @app.get("/customers", response_model=CustomerResponse)
 async def get_customer_by_userId(
     userId: str = Query(..., description="Customer email address (userId)"),
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
@@ -556,11 +862,7 @@ async def get_customer_by_userId(
         )
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute("SELECT * FROM Customers WHERE userId = %s", (userId,))
-        customer = cursor.fetchone()
+        customer = await customer_repository.get_by_user_id(userId)
 
         if not customer:
             raise HTTPException(
@@ -568,7 +870,7 @@ async def get_customer_by_userId(
                 detail="Customer not found"
             )
 
-        return customer
+        return etag_response(customer, if_none_match)
 
     except HTTPException as e:
         raise e
@@ -577,12 +879,22 @@ async def get_customer_by_userId(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 @app.get("/status", response_model=str)
 def health_check():
-    return "OK"
\ No newline at end of file
+    return "OK"
+
+@app.get("/metrics")
+async def metrics():
+    stats = {
+        "db": db_engine.stats(),
+        "idempotency": idempotency_store.stats(),
+        "book_cache": book_cache.stats(),
+        "related_books_cache": related_books_cache.stats(),
+    }
+    if write_coalescer is not None:
+        stats["write_coalescer"] = write_coalescer.stats()
+    daemon_stats = await cache_daemon_stats()
+    if daemon_stats is not None:
+        stats["cache_daemon"] = daemon_stats
+    return stats
@@ -1,20 +1,31 @@
-from fastapi import FastAPI, HTTPException, Header, Response, Query, status, Request
+from fastapi import FastAPI, HTTPException, Header, Query, status, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from services.shared.kafka_broker import send_customer_event
+from services.shared.models import CustomerLookup
+from services.shared.db_engine import create_engine
+from services.shared.db_router import track_client_writes
+from services.shared.db_health import DB_CONNECT_TIMEOUT, DB_QUERY_TIMEOUT
+from services.shared.repositories import BookRepository, CustomerRepository, IdempotencyRepository
+from services.shared.write_coalescer import create_write_coalescer
+from services.shared.idempotency import IdempotencyStore
+from services.shared.cache_client import close_cache_client
+from services.shared.cache import TTLCache, cache_daemon_stats
+from services.shared.fast_json import FastJSONResponse, json_response
+from services.shared.etag import etag_response
 import logging
 from pydantic import BaseModel, constr, condecimal, conint, EmailStr, validator, ValidationError
-from typing import Optional
+from typing import List, Optional
 import mariadb
+from mariadb.constants import CLIENT
 import os
-import time
 from decimal import Decimal
 import jwt
 from datetime import datetime
 import json
 from jwt_validator import validate_jwt_token
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # JWT validation constants
 VALID_SUBJECTS = {"starlord", "gamora", "drax", "rocket", "groot"}
@@ -31,6 +42,12 @@ logging.basicConfig(level=logging.INFO)
 # if not logger.handlers:
 #     logger.addHandler(handler)
 
+# Multi-get: most customers resolved by one request
+MAX_MULTI_GET = int(os.getenv("MAX_MULTI_GET", "100"))
+# Unknown customer ids at or below the highest id seen answered with 404 from the cache
+CUSTOMER_NOT_FOUND_CACHE_SIZE = int(os.getenv("CUSTOMER_NOT_FOUND_CACHE_SIZE", "10000"))
+CUSTOMER_NOT_FOUND_TTL = float(os.getenv("CUSTOMER_NOT_FOUND_TTL", "5"))
+
 # Determine if this is a BFF service based on port
 # IS_BFF_SERVICE = os.getenv("SERVICE_TYPE", "80") == "80"
 IS_BFF_SERVICE = False
@@ -59,6 +76,20 @@ async def validate_auth(authorization: Optional[str] = Header(None)):
         validate_jwt_token(authorization)
     return authorization
 
+@app.on_event("startup")
+async def startup_event():
+    await db_engine.open()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if write_coalescer is not None:
+        await write_coalescer.close()
+    await close_cache_client()
+    await db_engine.close()
+
+# Reads by a client that just wrote go to the primary on every worker and pod
+app.middleware("http")(track_client_writes)
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
     # Check if the error is due to missing Authorization header
@@ -96,27 +127,41 @@ db_config = {
     "user": os.getenv("DB_USER", "Bookstore"),
     "password": os.getenv("DB_PASSWORD", "password"),
     "database": os.getenv("DB_NAME", "Bookstore"),
-    "connect_timeout": 300000,  # 5 minutes connection timeout
-    "read_timeout": 300000,     # 5 minutes read timeout
-    "write_timeout": 300000     # 5 minutes write timeout
+    "connect_timeout": DB_CONNECT_TIMEOUT,      # Seconds per connection attempt
+    "read_timeout": int(DB_QUERY_TIMEOUT),      # Hard cap on waiting for a query result
+    "write_timeout": int(DB_QUERY_TIMEOUT),
+    "client_flag": CLIENT.FOUND_ROWS            # UPDATE rowcount counts matched rows, not changed rows
 }
 
-def get_db_connection():
-    retries = 5
-    while retries > 0:
-        try:
-            connection = mariadb.connect(**db_config)
-            connection.autocommit = False
-            return connection
-        except mariadb.Error as e:
-            print(f"Database connection error: {str(e)}")
-            retries -= 1
-            if retries == 0:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Database connection failed: {str(e)}"
-                )
-            time.sleep(2)  # Increased sleep time between retries
+def get_db_connection(config=db_config):
+    # Single attempt; the engine retries with async backoff (see services.shared.db_health)
+    connection = mariadb.connect(**config)
+    connection.autocommit = False
+    return connection
+
+# Per-worker database engine selected by DB_ENGINE ("threaded" pool + executor, or "async"),
+# routing reads to DB_REPLICA_HOSTS when set
+db_engine = create_engine(get_db_connection, db_config)
+# Optional group commit for single-row writes (DB_COALESCE_WRITES)
+write_coalescer = create_write_coalescer(db_engine)
+book_repository = BookRepository(db_engine, write_coalescer)
+customer_repository = CustomerRepository(db_engine, write_coalescer)
+# Responses to POSTs sent with an Idempotency-Key header, kept in the database
+# so a retry that reaches another replica is still recognized
+idempotency_store = IdempotencyStore(backend=IdempotencyRepository(db_engine))
+# Not-found results only (ttl 0): found customers are always read from the database.
+# Only ids at or below known_max_customer_id go through it: ids come from
+# AUTO_INCREMENT, so a gap below an id already handed out stays a gap, while
+# an id above it may be the next signup on any replica. This needs no
+# invalidation that would have to reach every pod. userIds are not cached,
+# as any of them can be signed up at any time.
+missing_customers = TTLCache("customers", CUSTOMER_NOT_FOUND_CACHE_SIZE, 0, negative_ttl=CUSTOMER_NOT_FOUND_TTL)
+known_max_customer_id = 0
+
+def note_customer_id(id):
+    """Raise known_max_customer_id to an id read from or written to the database."""
+    global known_max_customer_id
+    known_max_customer_id = max(known_max_customer_id, id)
 
 # Data Model for Validation
 class Book(BaseModel):
@@ -185,60 +230,39 @@ class CustomerResponse(CustomerBase):
 @app.post("/books", status_code=status.HTTP_201_CREATED)
 async def add_book(
     book: Book,
-    response: Response,
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
     # await validate_auth(authorization)
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # Check if ISBN already exists
-        cursor.execute("SELECT ISBN FROM Books WHERE ISBN = %s", (book.ISBN,))
-        existing_book = cursor.fetchone()
-        
-        if existing_book:
-            raise HTTPException(
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                detail="This ISBN already exists in the system."
-            )
-
-        # Insert the new book
-        cursor.execute(
-            "INSERT INTO Books (ISBN, title, Author, description, genre, price, quantity) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-            (book.ISBN, book.title, book.Author, book.description, book.genre, float(book.price), book.quantity)
-        )
-        conn.commit()
+    async def create():
+        try:
+            # Insert the new book; the primary key rejects an existing ISBN
+            if not await book_repository.insert(book):
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="This ISBN already exists in the system."
+                )
 
-        # Set Location header
-        response.headers["Location"] = f"/books/{book.ISBN}"
+            return json_response(
+                book,
+                status_code=status.HTTP_201_CREATED,
+                headers={"Location": f"/books/{book.ISBN}"}
+            )
 
-        return {
-            "ISBN": book.ISBN,
-            "title": book.title,
-            "Author": book.Author,
-            "description": book.description,
-            "genre": book.genre,
-            "price": float(book.price),
-            "quantity": book.quantity
-        }
+        except HTTPException as e:
+            raise e
+        except Exception as err:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=str(err)
+            )
 
-    except HTTPException as e:
-        raise e
-    except Exception as err:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=str(err)
-        )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+    # A retry with the same Idempotency-Key gets the stored response
+    return await idempotency_store.run("POST /books", idempotency_key, book, create)
 
 @app.put("/books/{ISBN}", status_code=status.HTTP_200_OK)
 async def update_book(
@@ -259,31 +283,17 @@ async def update_book(
         )
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # Check if book exists
-        cursor.execute("SELECT * FROM Books WHERE ISBN = %s", (ISBN,))
-        existing_book = cursor.fetchone()
-
-        if not existing_book:
+        # A missing book shows up as an UPDATE that matched no rows
+        if not await book_repository.update(book):
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
 
-        cursor.execute(
-            """UPDATE Books 
-               SET title = %s, Author = %s, description = %s, genre = %s, price = %s, quantity = %s
-               WHERE ISBN = %s""",
-            (book.title, book.Author, book.description, book.genre, float(book.price), book.quantity, ISBN)
-        )
-        conn.commit()
-
         return {
             "ISBN": ISBN,
             "title": book.title,
             "Author": book.Author,
             "description": book.description,
             "genre": book.genre,
-            "price": float(book.price),
+            "price": book.price,
             "quantity": book.quantity
         }
 
@@ -294,30 +304,22 @@ async def update_book(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 @app.get("/books/{ISBN}")
 @app.get("/books/isbn/{ISBN}")
 async def get_book(
     ISBN: str,
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
     # await validate_auth(authorization)
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
         # Fetch book from database
-        cursor.execute("SELECT * FROM Books WHERE ISBN = %s", (ISBN,))
-        book = cursor.fetchone()
+        book = await book_repository.get(ISBN)
 
         if not book:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
@@ -327,7 +329,7 @@ async def get_book(
         #     if book["genre"] == "non-fiction":
         #         book["genre"] = "3"
 
-        return book
+        return etag_response(book, if_none_match)
 
     except HTTPException as e:
         raise e
@@ -336,69 +338,99 @@ async def get_book(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 @app.post("/customers", response_model=CustomerResponse, status_code=status.HTTP_201_CREATED)
 async def add_customer(
     customer: CustomerBase,
-    response: Response,
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
     # await validate_auth(authorization)
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+    async def create():
+        try:
+            # Insert new customer; the unique userId constraint rejects duplicates
+            new_id = await customer_repository.insert(customer)
 
-        # Check if userId already exists
-        cursor.execute("SELECT id FROM Customers WHERE userId = %s", (customer.userId,))
-        existing_customer = cursor.fetchone()
+            if new_id is None:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="This user ID already exists in the system."
+                )
+            note_customer_id(new_id)
+            # Only set if the id was looked up while its insert was in flight
+            await missing_customers.invalidate_after_write(f"id:{new_id}")
+
+            # Return the customer data directly
+            customer_data = {
+                "id": new_id,
+                "userId": customer.userId,
+                "name": customer.name,
+                "phone": customer.phone,
+                "address": customer.address,
+                "address2": customer.address2,
+                "city": customer.city,
+                "state": customer.state,
+                "zipcode": customer.zipcode
+            }
+            try:
+                logger.info(f"Sending customer event: {customer_data}")
+                send_customer_event(customer_data)
+            except Exception as e:
+                logger.info(f"Error sending customer event: {e}")
+            return json_response(
+                customer_data,
+                status_code=status.HTTP_201_CREATED,
+                headers={"Location": f"/customers/{new_id}"}
+            )
 
-        if existing_customer:
+        except HTTPException as e:
+            raise e
+        except Exception as err:
             raise HTTPException(
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                detail="This user ID already exists in the system."
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=str(err)
             )
 
-        # Insert new customer
-        cursor.execute(
-            """INSERT INTO Customers (userId, name, phone, address, address2, city, state, zipcode)
-               VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-            (customer.userId, customer.name, customer.phone, customer.address, 
-             customer.address2, customer.city, customer.state, customer.zipcode)
+    # A retry with the same Idempotency-Key gets the stored response and
+    # does not insert or publish the customer event again
+    return await idempotency_store.run("POST /customers", idempotency_key, customer, create)
+
+def parse_customer_lookup(ids: Optional[List[int]], user_ids: Optional[List[str]]):
+    if (ids is None) == (user_ids is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Exactly one of id or userId is required"
         )
-        conn.commit()
-
-        new_id = cursor.lastrowid
-
-        # Set Location header
-        response.headers["Location"] = f"/customers/{new_id}"
-
-        # Return the customer data directly
-        customer_data = {
-            "id": new_id,
-            "userId": customer.userId,
-            "name": customer.name,
-            "phone": customer.phone,
-            "address": customer.address,
-            "address2": customer.address2,
-            "city": customer.city,
-            "state": customer.state,
-            "zipcode": customer.zipcode
-        }
-        try:
-            logger.info(f"Sending customer event: {customer_data}")
-            send_customer_event(customer_data)
-        except Exception as e:
-            logger.info(f"Error sending customer event: {e}")
-        return customer_data
+    values = ids if ids is not None else [user_id.strip() for user_id in user_ids if user_id.strip()]
+    if not values:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one customer is required")
+    if len(values) > MAX_MULTI_GET:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_MULTI_GET} customers can be requested at once"
+        )
+    if ids is not None and any(id <= 0 for id in ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid customer ID")
+    return values
+
+async def lookup_customers(ids: Optional[List[int]] = None, user_ids: Optional[List[str]] = None):
+    """Resolve customer ids or userIds with one query; results follow the request order."""
+    values = parse_customer_lookup(ids, user_ids)
+
+    try:
+        if ids is not None:
+            found = await customer_repository.get_many_by_id(values)
+            return json_response([found.get(id) or {"id": id, "message": "Customer not found"} for id in values])
+
+        found = await customer_repository.get_many_by_user_id(values)
+        return json_response([
+            found.get(user_id.lower()) or {"userId": user_id, "message": "Customer not found"}
+            for user_id in values
+        ])
 
     except HTTPException as e:
         raise e
@@ -407,17 +439,38 @@ async def add_customer(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+
+# Multi-get endpoints (GET for short lists, POST for long ones); declared
+# before /customers/{id} so "lookup" is not parsed as an id
+@app.get("/customers/lookup")
+async def get_customers(
+    id: Optional[str] = Query(None, description="Comma-separated list of customer IDs"),
+    userId: Optional[str] = Query(None, description="Comma-separated list of customer email addresses"),
+    x_client_type: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    ids = None
+    if id is not None:
+        try:
+            ids = [int(value) for value in id.split(",") if value.strip()]
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid customer ID")
+    return await lookup_customers(ids, userId.split(",") if userId is not None else None)
+
+@app.post("/customers/lookup", status_code=status.HTTP_200_OK)
+async def lookup_customers_post(
+    lookup: CustomerLookup,
+    x_client_type: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    return await lookup_customers(lookup.id, lookup.userId)
 
 @app.get("/customers/{id}", response_model=CustomerResponse)
 async def get_customer(
     id: int,
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
@@ -430,18 +483,19 @@ async def get_customer(
                 detail="Invalid customer ID"
             )
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # Fetch customer from database
-        cursor.execute("SELECT * FROM Customers WHERE id = %s", (id,))
-        customer = cursor.fetchone()
+        # Fetch customer from database unless the id is known to be missing
+        if id <= known_max_customer_id:
+            customer = await missing_customers.get_or_load(f"id:{id}", lambda: customer_repository.get_by_id(id))
+        else:
+            customer = await customer_repository.get_by_id(id)
+            if customer:
+                note_customer_id(id)
 
         if not customer:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Customer not found")
-
+            return json_response({"message": "Customer not found"}, status_code=status.HTTP_404_NOT_FOUND)
 
-        return customer
+        # 304 when the client already holds this version
+        return etag_response(customer, if_none_match)
 
     except HTTPException as e:
         raise e
@@ -450,17 +504,13 @@ async def get_customer(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 @app.get("/customers", response_model=CustomerResponse)
 async def get_customer_by_userId(
     userId: str = Query(..., description="Customer email address (userId)"),
     x_client_type: Optional[str] = Header(None),
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ):
     # Validate headers only for BFF service
     # await validate_client_type(x_client_type)
@@ -474,19 +524,13 @@ async def get_customer_by_userId(
         )
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute("SELECT * FROM Customers WHERE userId = %s", (userId,))
-        customer = cursor.fetchone()
+        customer = await customer_repository.get_by_user_id(userId)
 
         if not customer:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Customer not found"
-            )
+            return json_response({"message": "Customer not found"}, status_code=status.HTTP_404_NOT_FOUND)
+        note_customer_id(customer["id"])
 
-        return customer
+        return etag_response(customer, if_none_match)
 
     except HTTPException as e:
         raise e
@@ -495,12 +539,17 @@ async def get_customer_by_userId(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(err)
         )
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 @app.get("/status", response_model=str)
 def health_check():
-    return "OK"
\ No newline at end of file
+    return "OK"
+
+@app.get("/metrics")
+async def metrics():
+    stats = {"db": db_engine.stats(), "idempotency": idempotency_store.stats(), "missing_customers": missing_customers.stats()}
+    if write_coalescer is not None:
+        stats["write_coalescer"] = write_coalescer.stats()
+    daemon_stats = await cache_daemon_stats()
+    if daemon_stats is not None:
+        stats["cache_daemon"] = daemon_stats
+    return stats
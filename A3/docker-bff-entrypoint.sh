@@ -46,6 +46,13 @@ wait_for_backend() {
 # wait_for_backend "$BOOKS_SERVICE_URL" "Books Service"
 # wait_for_backend "$CUSTOMERS_SERVICE_URL" "Customers Service"
 
+# Cache daemon shared by the uvicorn workers (services/shared/cache_daemon.py);
+# set CACHE_SOCKET to an empty string to keep caches inside each worker
+export CACHE_SOCKET=${CACHE_SOCKET-/tmp/bookstore-cache.sock}
+if [ -n "$CACHE_SOCKET" ]; then
+    python -m services.shared.cache_daemon &
+fi
+
 echo "Starting BFF service on port 80..."
 
 # Use UVICORN_LOG_LEVEL to control logging verbosity
@@ -54,5 +54,12 @@ else
     WORKERS=2
 fi
 
+# Cache daemon shared by the uvicorn workers (services/shared/cache_daemon.py);
+# set CACHE_SOCKET to an empty string to keep caches inside each worker
+export CACHE_SOCKET=${CACHE_SOCKET-/tmp/bookstore-cache.sock}
+if [ -n "$CACHE_SOCKET" ]; then
+    python -m services.shared.cache_daemon &
+fi
+
 echo "Starting service on port $PORT with $WORKERS workers"
 exec uvicorn main:app --host 0.0.0.0 --port "$PORT" --workers "$WORKERS" --timeout-keep-alive 75
\ No newline at end of file
@@ -4,6 +4,7 @@ USE Bookstore;
 -- Drop existing tables if they exist
 DROP TABLE IF EXISTS Books;
 DROP TABLE IF EXISTS Customers;
+DROP TABLE IF EXISTS IdempotencyKeys;
 
 CREATE TABLE IF NOT EXISTS Books (
     ISBN VARCHAR(20) PRIMARY KEY,
@@ -12,7 +13,15 @@ CREATE TABLE IF NOT EXISTS Books (
     description TEXT NOT NULL,
     genre VARCHAR(100) NOT NULL,
     price DECIMAL(10,2) NOT NULL CHECK (price >= 0),
-    quantity INT NOT NULL CHECK (quantity >= 0)
+    quantity INT NOT NULL CHECK (quantity >= 0),
+    -- Catalog listing filters. For the equality filters ISBN comes last so the
+    -- index also serves the keyset order (ISBN > cursor); a price range cannot,
+    -- so it narrows the rows and the page is sorted by ISBN afterwards
+    INDEX idx_books_genre (genre, ISBN),
+    INDEX idx_books_author (Author, ISBN),
+    INDEX idx_books_price (price),
+    -- Catalog search (GET /books/search)
+    FULLTEXT INDEX ft_books_search (title, Author, description)
 );
 
 CREATE TABLE IF NOT EXISTS Customers (
@@ -25,4 +34,13 @@ CREATE TABLE IF NOT EXISTS Customers (
     city VARCHAR(100) NOT NULL,
     state CHAR(2) NOT NULL,
     zipcode VARCHAR(10) NOT NULL
-); 
\ No newline at end of file
+); 
+
+-- Responses to POSTs sent with an Idempotency-Key header, shared by all
+-- replicas (see IdempotencyRepository); key_hash is the SHA-256 of the key
+CREATE TABLE IF NOT EXISTS IdempotencyKeys (
+    key_hash CHAR(64) PRIMARY KEY,
+    value MEDIUMTEXT NOT NULL,
+    expires_at DATETIME(6) NOT NULL,
+    INDEX idx_idempotency_expires (expires_at)
+);
@@ -0,0 +1,27 @@
+"""Tests for services.shared.cache."""
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "archive"))
+
+from services.shared.cache import LocalBackend, TTLCache  # noqa: E402
+from services.shared.cache_client import CacheUnavailableError  # noqa: E402
+
+
+class UnconfirmedDeleteBackend(LocalBackend):
+    """Shared backend whose daemon stopped answering before a DEL was confirmed."""
+
+    async def delete(self, *keys):
+        raise CacheUnavailableError("cache daemon did not confirm DEL")
+
+
+def test_invalidate_after_write_logs_instead_of_raising(caplog):
+    cache = TTLCache("books", max_entries=16, ttl=60, backend=UnconfirmedDeleteBackend(16))
+
+    async def scenario():
+        await cache.invalidate_after_write("isbn:978-0000000001")
+
+    asyncio.run(scenario())
+    assert cache.stats()["failed_invalidations"] == 1
+    assert "Could not invalidate books entries" in caplog.text
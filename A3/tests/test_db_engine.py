@@ -0,0 +1,285 @@
+"""Tests for the connection pool, ThreadedEngine sessions and the repositories on top of them."""
+import os
+import sys
+import time
+import asyncio
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "archive"))
+
+mariadb = pytest.importorskip("mariadb")
+
+from fastapi import HTTPException  # noqa: E402
+
+from services.shared.db_engine import ThreadedEngine  # noqa: E402
+from services.shared.db_executor import DBExecutor  # noqa: E402
+from services.shared.db_pool import ConnectionPool  # noqa: E402
+from services.shared.models import Book  # noqa: E402
+from services.shared.repositories import BookRepository  # noqa: E402
+
+QUERY_TIME = 0.005
+
+
+class FakeDatabase:
+    """Books table shared by FakeConnections; each connection has its own transaction."""
+
+    def __init__(self, isbns=()):
+        self.books = {isbn: (isbn, "Title", "Author", "Description", "fiction", 9.99, 1) for isbn in isbns}
+        self.lock = threading.Lock()
+        self.commands = []
+
+
+class FakeCursor:
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._dictionary = dictionary
+        self._rows = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def execute(self, sql, args=()):
+        time.sleep(QUERY_TIME)
+        self._conn.run(self, sql, args)
+
+    def executemany(self, sql, seq_of_args):
+        for args in seq_of_args:
+            self.execute(sql, args)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self._db = db
+        self._pending = []     # Rows inserted in the open transaction
+        self._savepoints = {}  # name -> len(_pending)
+        self.closed = False
+
+    def cursor(self, prepared=False, dictionary=False, buffered=True):
+        return FakeCursor(self, dictionary)
+
+    def run(self, cursor, sql, args):
+        sql = " ".join(sql.split())
+        with self._db.lock:
+            if sql.startswith("SAVEPOINT"):
+                self._db.commands.append(sql)
+                self._savepoints[sql.split()[-1]] = len(self._pending)
+            elif sql.startswith("ROLLBACK TO SAVEPOINT"):
+                self._db.commands.append(sql)
+                del self._pending[self._savepoints[sql.split()[-1]]:]
+            elif sql.startswith("INSERT INTO Books"):
+                isbn = args[0]
+                if isbn in self._db.books or any(row[0] == isbn for row in self._pending):
+                    raise mariadb.IntegrityError(f"Duplicate entry '{isbn}' for key 'PRIMARY'")
+                self._pending.append(tuple(args))
+                cursor.rowcount = 1
+            elif sql.startswith("SELECT ISBN FROM Books WHERE ISBN IN"):
+                cursor._rows = [{"ISBN": isbn} for isbn in dict.fromkeys(args) if isbn in self._db.books]
+            elif sql.startswith("SELECT") and sql.endswith("WHERE ISBN = %s"):
+                row = self._db.books.get(args[0])
+                cursor._rows = [row] if row else []
+            else:
+                raise AssertionError(f"Unexpected SQL: {sql}")
+
+    def commit(self):
+        with self._db.lock:
+            for row in self._pending:
+                self._db.books[row[0]] = row
+        self.rollback()
+
+    def rollback(self):
+        self._pending = []
+        self._savepoints = {}
+
+    def ping(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def make_engine(db, pool_size=3, workers=3, borrow_timeout=2):
+    pool = ConnectionPool(lambda: FakeConnection(db), min_size=0, max_size=pool_size, borrow_timeout=borrow_timeout)
+    return ThreadedEngine(None, pool=pool, executor=DBExecutor(max_workers=workers))
+
+
+def isbn(i):
+    return f"978-{i:010d}"
+
+
+def book(number):
+    return Book(ISBN=isbn(number), title="Title", Author="Author", description="Description",
+                genre="fiction", price="9.99", quantity=1)
+
+
+def test_pool_hands_out_at_most_max_size_connections():
+    pool = ConnectionPool(lambda: FakeConnection(FakeDatabase()), min_size=0, max_size=2, borrow_timeout=5)
+    borrowed, peak = [0], [0]
+    lock = threading.Lock()
+
+    def borrow():
+        conn = pool.acquire()
+        with lock:
+            borrowed[0] += 1
+            peak[0] = max(peak[0], borrowed[0])
+        time.sleep(0.01)
+        with lock:
+            borrowed[0] -= 1
+        pool.release(conn)
+
+    threads = [threading.Thread(target=borrow) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+    assert pool.stats()["size"] == 2
+    assert pool.stats()["in_use"] == 0
+
+
+def test_pool_acquire_times_out_when_every_connection_is_borrowed():
+    pool = ConnectionPool(lambda: FakeConnection(FakeDatabase()), min_size=0, max_size=1, borrow_timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(HTTPException) as error:
+        pool.acquire()
+    assert error.value.status_code == 503
+    pool.release(conn)
+    pool.release(pool.acquire())
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_more_concurrent_sessions_than_pool_connections():
+    db = FakeDatabase(isbns=[isbn(i) for i in range(30)])
+    engine = make_engine(db, pool_size=3, workers=3)
+    repository = BookRepository(engine)
+
+    async def scenario():
+        started = time.monotonic()
+        books = await asyncio.gather(*(repository.get(isbn(i)) for i in range(30)))
+        return books, time.monotonic() - started
+
+    try:
+        books, elapsed = asyncio.run(scenario())
+        assert [b["ISBN"] for b in books] == [isbn(i) for i in range(30)]
+        assert elapsed < 2  # Ten rounds of three queries, not a pool timeout
+        stats = engine.stats()
+        assert stats["pool"]["size"] <= 3
+        assert stats["pool"]["in_use"] == 0
+        assert stats["waiting_for_connection"] == 0
+        assert stats["executor"]["queued"] == 0
+    finally:
+        engine.executor.shutdown()
+
+
+def test_session_returns_its_connection_when_the_block_raises():
+    engine = make_engine(FakeDatabase(isbns=[isbn(1)]), pool_size=1, workers=1)
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                async with engine.session() as session:
+                    await session.fetchone("SELECT ISBN FROM Books WHERE ISBN = %s", (isbn(1),))
+                    raise RuntimeError("handler failed")
+        # The permit and the connection came back each time
+        async with engine.session() as session:
+            return await session.fetchone("SELECT ISBN FROM Books WHERE ISBN = %s", (isbn(1),), dictionary=False)
+
+    try:
+        assert asyncio.run(scenario())[0] == isbn(1)
+        assert engine.pool.stats()["in_use"] == 0
+        assert engine.pool.stats()["created"] == 1
+    finally:
+        engine.executor.shutdown()
+
+
+def test_session_waits_for_a_connection_without_holding_a_thread():
+    engine = make_engine(FakeDatabase(isbns=[isbn(1)]), pool_size=1, workers=1, borrow_timeout=1)
+    query = "SELECT ISBN FROM Books WHERE ISBN = %s"
+
+    async def second_session():
+        async with engine.session() as session:
+            return await session.fetchone(query, (isbn(1),), dictionary=False)
+
+    async def scenario():
+        async with engine.session() as session:
+            waiter = asyncio.ensure_future(second_session())
+            await asyncio.sleep(0.05)
+            # The second session waits for the connection on the event loop,
+            # so the only thread is still free for this session's query
+            started = time.monotonic()
+            await session.fetchone(query, (isbn(1),))
+            assert time.monotonic() - started < 0.5
+        return await waiter
+
+    try:
+        assert asyncio.run(scenario())[0] == isbn(1)
+        assert engine.pool.stats()["in_use"] == 0
+    finally:
+        engine.executor.shutdown()
+
+
+def test_session_times_out_waiting_for_a_connection():
+    engine = make_engine(FakeDatabase(), pool_size=1, workers=1, borrow_timeout=0.05)
+
+    async def scenario():
+        async with engine.session():
+            with pytest.raises(HTTPException) as error:
+                async with engine.session():
+                    pass
+            assert error.value.status_code == 503
+            assert engine.executor.stats()["queued"] == 0
+
+    try:
+        asyncio.run(scenario())
+        assert engine.pool.stats()["in_use"] == 0
+    finally:
+        engine.executor.shutdown()
+
+
+def test_insert_many_undoes_rows_inserted_before_a_concurrent_duplicate():
+    db = FakeDatabase(isbns=[isbn(0)])
+    engine = make_engine(db)
+    repository = BookRepository(engine)
+    books = [book(i) for i in range(1, 5)]
+
+    class RacingConnection(FakeConnection):
+        # Another writer inserts isbn-3 after the existence check
+        def run(self, cursor, sql, args):
+            if sql.startswith("SELECT ISBN FROM Books WHERE ISBN IN"):
+                super().run(cursor, sql, args)
+                db.books[isbn(3)] = (isbn(3), "Other", "Other", "Other", "other", 1.0, 1)
+                return
+            super().run(cursor, sql, args)
+
+    engine.pool._connect = lambda: RacingConnection(db)
+
+    try:
+        existing = asyncio.run(repository.insert_many(books))
+        assert existing == {isbn(3)}
+        assert db.books[isbn(3)][1] == "Other"
+        assert {isbn(1), isbn(2), isbn(4)} <= db.books.keys()
+        assert "ROLLBACK TO SAVEPOINT insert_many" in db.commands
+    finally:
+        engine.executor.shutdown()
+
+
+def test_insert_reports_an_existing_book():
+    db = FakeDatabase(isbns=[isbn(1)])
+    engine = make_engine(db)
+    repository = BookRepository(engine)
+    try:
+        assert asyncio.run(repository.insert(book(1))) is False
+        assert asyncio.run(repository.insert(book(2))) is True
+        assert isbn(2) in db.books
+    finally:
+        engine.executor.shutdown()
@@ -0,0 +1,36 @@
+"""Tests for services.shared.db_executor."""
+import os
+import sys
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "archive"))
+
+from services.shared.db_executor import DBExecutor  # noqa: E402
+
+
+def test_cancelled_queued_call_leaves_the_queue():
+    executor = DBExecutor(max_workers=1, max_queue=4)
+    release = threading.Event()
+    ran = []
+
+    async def scenario():
+        blocker = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)  # Let the only thread pick up the blocking job
+        try:
+            await asyncio.wait_for(executor.run(ran.append, "queued"), 0.05)
+        except asyncio.TimeoutError:
+            pass
+        queued = executor.stats()["queued"]
+        release.set()
+        await blocker
+        assert queued == 0
+
+    try:
+        asyncio.run(scenario())
+        executor._executor.shutdown(wait=True)  # The cancelled job is dropped once a thread reaches it
+        assert executor.stats()["queued"] == 0
+        assert executor.stats()["active"] == 0
+        assert ran == []
+    finally:
+        executor.shutdown()